@@ -1,3 +1,5 @@
+import logging
+
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, parser_classes
@@ -15,8 +17,11 @@ from django.utils import timezone
 
 
 from .models import User, UserAddress
+from apps.orders.guest_cart import HEADER as GUEST_CART_HEADER, GuestCart
 from .serializers import *
 
+logger = logging.getLogger(__name__)
+
 
 
 
@@ -188,7 +193,7 @@ class UserViewSet(viewsets.GenericViewSet):
 
     @swagger_auto_schema(
         operation_summary="User login",
-        operation_description="Login with username and password to get auth tokens",
+        operation_description="Login with username and password to get auth tokens. Send the guest cart's X-Cart-Token header to merge that cart into the user's cart.",
         request_body=UserLoginSerializer,
         tags=['Users']
     )
@@ -204,6 +209,13 @@ class UserViewSet(viewsets.GenericViewSet):
         user = authenticate(username=username, password=password)
         
         if user:
+            guest_cart_token = request.headers.get(GUEST_CART_HEADER, '').strip()
+            if guest_cart_token:
+                # A cart that fails to merge must not stop the login.
+                try:
+                    GuestCart.load(guest_cart_token).merge_into(user)
+                except Exception:
+                    logger.exception("Could not merge guest cart into user %s's cart", user.pk)
             refresh = RefreshToken.for_user(user)
             user_serializer = self.get_serializer(user)
             return Response({
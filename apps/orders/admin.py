@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Cart, CartItem, Coupon
+from .coupons import coupon_index
+from .models import Order, OrderItem, Cart, CartItem, Coupon, CouponRedemption
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -189,13 +190,26 @@ class CouponAdmin(admin.ModelAdmin):
 
     def activate_coupons(self, request, queryset):
         updated = queryset.update(is_active=True)
+        coupon_index.invalidate()
         self.message_user(request, f'{updated} کوپن فعال شد.')
     activate_coupons.short_description = "فعال کردن کوپن‌های انتخاب شده"
 
     def deactivate_coupons(self, request, queryset):
         updated = queryset.update(is_active=False)
+        coupon_index.invalidate()
         self.message_user(request, f'{updated} کوپن غیرفعال شد.')
     deactivate_coupons.short_description = "غیرفعال کردن کوپن‌های انتخاب شده"
 
     def get_queryset(self, request):
-        return super().get_queryset(request)
\ No newline at end of file
+        return super().get_queryset(request)
+
+@admin.register(CouponRedemption)
+class CouponRedemptionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'coupon', 'order', 'user', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('coupon__code', 'order__order_number', 'user__email')
+    raw_id_fields = ['coupon', 'order', 'user']
+    readonly_fields = ('created_at',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('coupon', 'order', 'user')
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class OrdersConfig(AppConfig):
+    name = 'apps.orders'
+    label = 'orders'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,343 @@
+"""
+Write-behind storage for logged-in carts.
+
+With `CART_WRITE_BEHIND` enabled, cart changes are applied to a copy of the
+user's cart held in the shared cache instead of to `CartItem` rows. Carts that
+changed are recorded in a change log in the same cache, and
+`flush_pending()` (the `flush_cart_buffers` command, run every
+`CART_FLUSH_INTERVAL` seconds) writes them to the database in batches.
+Checkout flushes the user's cart synchronously first. The cart endpoints
+answer with the same serializers either way; a line not flushed yet has no
+`id`, so clients address lines by their `line_id`, which is always set.
+
+Durability settings:
+
+- `CART_MAX_UNFLUSHED_SECONDS`: a change to a cart whose oldest unflushed
+  change is older than this is flushed right away, which bounds what is lost
+  if the flusher stops running.
+- `CART_BUFFER_TTL`: how long a buffered cart stays in the cache; keep it well
+  above the flush interval, since an evicted buffer loses its unflushed changes.
+
+Each user's buffer is changed under a per-user lock in the cache
+(`CART_LOCK_TIMEOUT`, default 10 seconds, bounds how long a crashed holder
+keeps it), so concurrent requests and the flusher don't overwrite each
+other's changes.
+
+The cache must be shared by all processes (not the per-process default) for
+this mode to be correct.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from apps.products.models import Color as ProductColor, Product, Size as ProductSize
+
+from .guest_cart import CachedCart, line_id
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+LOG_HEAD_KEY = 'orders:cart-buffer:log-head'
+LOG_FLUSHED_KEY = 'orders:cart-buffer:log-flushed'
+LOG_GAP_KEY = 'orders:cart-buffer:log-gap'
+
+# A log slot that is claimed but still unwritten after this long belongs to a
+# writer that died before storing its cart; its change was never saved either.
+LOG_GAP_GRACE = 60
+
+_held_locks = threading.local()
+
+
+def is_enabled():
+    return getattr(settings, 'CART_WRITE_BEHIND', False)
+
+
+def _log_key(position):
+    return f'orders:cart-buffer:log:{position}'
+
+
+def _append_to_log(user_id):
+    try:
+        position = cache.incr(LOG_HEAD_KEY)
+    except ValueError:
+        cache.add(LOG_HEAD_KEY, 0, None)
+        position = cache.incr(LOG_HEAD_KEY)
+    cache.set(_log_key(position), user_id, getattr(settings, 'CART_BUFFER_TTL', 24 * 60 * 60))
+
+
+@contextmanager
+def user_lock(user_id):
+    """
+    Hold the user's cart lock; re-entrant within a thread.
+    """
+    key = f'orders:cart-buffer:lock:{user_id}'
+    held = getattr(_held_locks, 'keys', None)
+    if held is None:
+        held = _held_locks.keys = set()
+    if key in held:
+        yield
+        return
+
+    token = get_random_string(16)
+    timeout = getattr(settings, 'CART_LOCK_TIMEOUT', 10)
+    # Waits at most `timeout`: by then a holder that never released has expired.
+    while not cache.add(key, token, timeout):
+        time.sleep(0.01)
+    held.add(key)
+    try:
+        yield
+    finally:
+        held.discard(key)
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+@contextmanager
+def editing(user_id):
+    """
+    The user's buffered cart, loaded and locked for a change and `commit()`.
+    """
+    with user_lock(user_id):
+        yield BufferedCart.load(user_id)
+
+
+class BufferedCart(CachedCart):
+    key_prefix = 'orders:cart-buffer'
+
+    def __init__(self, user_id, lines=None, revision=0, dirty_since=None):
+        super().__init__(user_id, lines)
+        self.revision = revision
+        self.dirty_since = dirty_since
+
+    @classmethod
+    def load(cls, user_id):
+        """
+        The user's buffered cart, read from their `CartItem` rows the first time.
+        """
+        state = cache.get(cls.cache_key(user_id))
+        if state is not None:
+            return cls(user_id, **state)
+
+        cart = cls(user_id)
+        for item in CartItem.objects.filter(cart__user_id=user_id):
+            cart.lines[line_id(item.product_id, item.selected_color_id, item.selected_size_id)] = {
+                'product_id': item.product_id,
+                'color_id': item.selected_color_id,
+                'size_id': item.selected_size_id,
+                'quantity': item.quantity,
+                'added_at': int(item.added_at.timestamp()),
+                'updated_at': int(item.updated_at.timestamp()),
+            }
+        # add(), not set(): never replace a buffer stored in the meantime.
+        if not cache.add(cls.cache_key(user_id), cart.dump(), cart.timeout()):
+            state = cache.get(cls.cache_key(user_id))
+            if state is not None:
+                return cls(user_id, **state)
+        return cart
+
+    def items(self):
+        """
+        As for guest carts, but with the id of the `CartItem` row each line
+        was flushed to (None until then), as in the rows' own responses.
+        """
+        items = super().items()
+        rows = CartItem.objects.filter(cart__user_id=self.token).values_list(
+            'product_id', 'selected_color_id', 'selected_size_id', 'id'
+        )
+        row_ids = {line_id(product_id, color_id, size_id): pk for product_id, color_id, size_id, pk in rows}
+        for item in items:
+            item.id = row_ids.get(item.line_id)
+        return items
+
+    @classmethod
+    def discard(cls, user_id):
+        """
+        Forget the buffer so the next load reads the rows again; for code
+        that changed the rows directly after a flush.
+        """
+        cache.delete(cls.cache_key(user_id))
+
+    def timeout(self):
+        return getattr(settings, 'CART_BUFFER_TTL', 24 * 60 * 60)
+
+    def dump(self):
+        return {'lines': self.lines, 'revision': self.revision, 'dirty_since': self.dirty_since}
+
+    def commit(self):
+        """
+        Store a change: log the cart for the flusher when it turns dirty, and
+        flush at once when its oldest unflushed change is too old. Call with
+        the user's lock held (`editing()`).
+        """
+        now = time.time()
+        self.revision += 1
+        if self.dirty_since is None:
+            self.dirty_since = now
+            _append_to_log(self.token)
+        self.save()
+        if now - self.dirty_since > getattr(settings, 'CART_MAX_UNFLUSHED_SECONDS', 5 * 60):
+            self.flush()
+
+    def flush(self):
+        """
+        Make the user's `CartItem` rows match the buffer: one delete, one
+        bulk update and one bulk create at most. Call with the user's lock
+        held.
+
+        Lines of products deleted since they were buffered are dropped, like
+        their rows; a deleted color or size becomes none, like on the rows.
+        """
+        products = set(Product.objects.filter(
+            pk__in={line['product_id'] for line in self.lines.values()}
+        ).values_list('pk', flat=True))
+        colors = set(ProductColor.objects.filter(
+            pk__in={line['color_id'] for line in self.lines.values() if line['color_id']}
+        ).values_list('pk', flat=True))
+        sizes = set(ProductSize.objects.filter(
+            pk__in={line['size_id'] for line in self.lines.values() if line['size_id']}
+        ).values_list('pk', flat=True))
+        self.lines = {key: line for key, line in self.lines.items() if line['product_id'] in products}
+
+        wanted = {}
+        for line in self.lines.values():
+            key = (
+                line['product_id'],
+                line['color_id'] if line['color_id'] in colors else None,
+                line['size_id'] if line['size_id'] in sizes else None,
+            )
+            if key in wanted:
+                wanted[key] = dict(wanted[key], quantity=wanted[key]['quantity'] + line['quantity'])
+            else:
+                wanted[key] = line
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user_id=self.token)
+            existing = {
+                (item.product_id, item.selected_color_id, item.selected_size_id): item for item in cart.items.all()
+            }
+            stale = [item.id for key, item in existing.items() if key not in wanted]
+            changed, new = [], []
+            for key, line in wanted.items():
+                item = existing.get(key)
+                if item is None:
+                    new.append(CartItem(
+                        cart=cart, product_id=line['product_id'], quantity=line['quantity'],
+                        selected_color_id=line['color_id'], selected_size_id=line['size_id'],
+                    ))
+                elif item.quantity != line['quantity']:
+                    item.quantity, item.updated_at = line['quantity'], timezone.now()
+                    changed.append(item)
+            if stale:
+                CartItem.objects.filter(id__in=stale).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+            if new:
+                CartItem.objects.bulk_create(new)
+
+        # Only mark clean if nothing changed the buffer while we were writing
+        # (possible only if the lock expired); otherwise log it again.
+        current = cache.get(self.cache_key(self.token))
+        if current is None:
+            return
+        if current['revision'] == self.revision:
+            self.dirty_since = None
+            self.save()
+        else:
+            _append_to_log(self.token)
+
+
+def flush_user_cart(user_id):
+    """
+    Flush the user's buffered cart, if any, before code that reads the rows.
+    """
+    with user_lock(user_id):
+        state = cache.get(BufferedCart.cache_key(user_id))
+        if state is not None and state['dirty_since'] is not None:
+            BufferedCart(user_id, **state).flush()
+
+
+@contextmanager
+def settled(user_id):
+    """
+    For code that changes the user's rows directly: flush and drop the buffer,
+    and hold the user's lock until done so no buffered change races it. The
+    next load reads the rows again.
+    """
+    if not is_enabled():
+        yield
+        return
+    with user_lock(user_id):
+        flush_user_cart(user_id)
+        BufferedCart.discard(user_id)
+        try:
+            yield
+        finally:
+            BufferedCart.discard(user_id)
+
+
+def settles_buffer(view):
+    """
+    Run a cart view method inside `settled()` for the requesting user.
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        with settled(request.user.pk):
+            return view(self, request, *args, **kwargs)
+    return wrapper
+
+
+def flush_pending(batch_size=500):
+    """
+    Flush every cart logged since the last run. Returns the number of carts
+    flushed.
+
+    Only slots that were read are consumed: the run stops at a slot that is
+    claimed but not written yet, unless it stayed empty for LOG_GAP_GRACE.
+    """
+    head = cache.get(LOG_HEAD_KEY, 0)
+    position = cache.get(LOG_FLUSHED_KEY, 0)
+    flushed = 0
+    while position < head:
+        end = min(head, position + batch_size)
+        keys = [_log_key(index) for index in range(position + 1, end + 1)]
+        found = cache.get_many(keys)
+
+        read = []
+        for index, key in enumerate(keys, start=position + 1):
+            if key not in found and not _gap_expired(index):
+                end = index - 1
+                break
+            read.append(key)
+
+        for user_id in {found[key] for key in read if key in found}:
+            try:
+                flush_user_cart(user_id)
+                flushed += 1
+            except Exception:
+                logger.exception("Could not flush the buffered cart of user %s", user_id)
+                _append_to_log(user_id)
+        cache.delete_many(read)
+        cache.set(LOG_FLUSHED_KEY, end, None)
+        if end < min(head, position + batch_size):
+            break
+        position = end
+    return flushed
+
+
+def _gap_expired(index):
+    """
+    Whether log slot `index` has been seen empty for longer than the grace.
+    """
+    gap = cache.get(LOG_GAP_KEY)
+    now = time.time()
+    if gap is None or gap[0] != index:
+        cache.set(LOG_GAP_KEY, (index, now), None)
+        return False
+    return now - gap[1] > LOG_GAP_GRACE
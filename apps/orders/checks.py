@@ -0,0 +1,44 @@
+"""
+System checks for settings the orders app needs when several processes
+serve the site.
+"""
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+NODE_MESSAGE = (
+    "Order number nodes are leased from a per-process cache, so two processes "
+    "can lease the same node and generate clashing order numbers."
+)
+NODE_HINT = (
+    "Configure a shared CACHES backend (e.g. set REDIS_URL), or set "
+    "ORDER_NUMBER_NODE to a distinct value (0-1023) in each process."
+)
+
+
+def _order_number_node_unsafe():
+    if getattr(settings, 'ORDER_NUMBER_NODE', None) is not None:
+        return False
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_order_number_node(app_configs, **kwargs):
+    """
+    Fine for a single development process, so only a warning here; see
+    the deployment check below.
+    """
+    if not _order_number_node_unsafe():
+        return []
+    return [Warning(NODE_MESSAGE, hint=NODE_HINT, id='orders.W001')]
+
+
+@register(deploy=True)
+def check_order_number_node_deploy(app_configs, **kwargs):
+    if not _order_number_node_unsafe():
+        return []
+    return [Error(NODE_MESSAGE, hint=NODE_HINT, id='orders.E001')]
@@ -0,0 +1,96 @@
+"""
+Process-local index of active coupons by normalized code.
+
+Coupon lookups in validate, apply and checkout are served from memory, so
+checking a hot promo code costs no queries. The index is built lazily per
+process and rebuilt when the version number in the cache changes; coupon
+saves and deletes (see `signals.py`) and the admin bulk actions bump it.
+
+`used_count` in the index is only as fresh as the last rebuild, so the usage
+check here is advisory: `Coupon.redeem()` is the authoritative claim, and a
+failed claim bumps the version so the exhausted coupon stops validating.
+`COUPON_INDEX_MAX_AGE` bounds how stale the index can get otherwise.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Coupon
+
+VERSION_CACHE_KEY = 'orders:coupon-index:version'
+
+INVALID = 'invalid'
+EXPIRED = 'expired'
+EXHAUSTED = 'exhausted'
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+class CouponIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built_at = None
+        self.coupons = {}
+
+    def build(self):
+        version = cache.get_or_set(VERSION_CACHE_KEY, 1, None)
+        coupons = {}
+        for coupon in Coupon.objects.filter(is_active=True).order_by('id'):
+            coupons.setdefault(normalize_code(coupon.code), coupon)
+        with self.lock:
+            self.coupons = coupons
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self):
+        max_age = getattr(settings, 'COUPON_INDEX_MAX_AGE', 300)
+        stale = (
+            self.version is None
+            or self.version != cache.get(VERSION_CACHE_KEY)
+            or time.monotonic() - self.built_at > max_age
+        )
+        if stale:
+            with self.lock:
+                self.build()
+
+    def get(self, code):
+        """
+        The active coupon for `code`, or None.
+        """
+        self.ensure_fresh()
+        return self.coupons.get(normalize_code(code))
+
+    def check(self, code):
+        """
+        Look up `code` and run the date and usage checks.
+
+        Returns (coupon, reason): reason is None for a usable coupon, else one
+        of INVALID, EXPIRED or EXHAUSTED. The coupon is None for INVALID.
+        """
+        coupon = self.get(code)
+        if coupon is None:
+            return None, INVALID
+        if not (coupon.valid_from <= timezone.now() <= coupon.valid_to):
+            return coupon, EXPIRED
+        if coupon.usage_limit is not None and coupon.used_count >= coupon.usage_limit:
+            return coupon, EXHAUSTED
+        return coupon, None
+
+    def invalidate(self):
+        """
+        Mark the index stale in every process.
+        """
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, None)
+        self.version = None
+
+
+coupon_index = CouponIndex()
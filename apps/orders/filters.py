@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Order
+
+
+class OrderHistoryFilter(BaseFilterBackend):
+    """
+    `?status=pending,shipped` keeps orders in any of those statuses;
+    `created_after` / `created_before` bound the creation time with Unix
+    timestamps, the same format orders are returned in.
+    """
+    def _timestamp(self, request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.fromtimestamp(int(value), tz=timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            raise ValidationError({name: "Expected a Unix timestamp."})
+
+    def filter_queryset(self, request, queryset, view):
+        statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+        if statuses:
+            valid = dict(Order.STATUS_CHOICES)
+            unknown = [value for value in statuses if value not in valid]
+            if unknown:
+                raise ValidationError({'status': f"Unknown status: {', '.join(unknown)}."})
+            queryset = queryset.filter(status__in=statuses)
+
+        created_after = self._timestamp(request, 'created_after')
+        if created_after:
+            queryset = queryset.filter(created_at__gte=created_after)
+        created_before = self._timestamp(request, 'created_before')
+        if created_before:
+            queryset = queryset.filter(created_at__lt=created_before)
+        return queryset
@@ -0,0 +1,188 @@
+"""
+Carts of anonymous visitors, kept in the cache instead of the database.
+
+A guest cart is identified by an opaque token the client receives on its first
+add and sends back in the `X-Cart-Token` header. The whole cart is one cache
+entry whose TTL (`GUEST_CART_TTL`) is renewed on every change, so browsing
+traffic never writes to the cart tables. On login the lines are merged into
+the user's `Cart` with one bulk write per kind of change.
+
+`CachedCart` holds the line bookkeeping shared with the write-behind buffer
+of logged-in carts in `cart_buffer.py`.
+"""
+import secrets
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from apps.products.models import Color as ProductColor, Product, Size as ProductSize
+
+from .models import Cart, CartItem
+
+HEADER = 'X-Cart-Token'
+
+
+def line_id(product_id, color_id=None, size_id=None):
+    return f'{product_id}-{color_id or 0}-{size_id or 0}'
+
+
+def parse_line_id(key):
+    """
+    (product_id, color_id, size_id) of a line id, or None if it is not one.
+    """
+    parts = str(key).split('-')
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return None
+    product_id, color_id, size_id = (int(part) for part in parts)
+    return product_id, color_id or None, size_id or None
+
+
+class CachedCart:
+    """
+    Cart lines held in one cache entry, keyed by line id
+    (`<product>-<color>-<size>`). Subclasses pick the key and what else is
+    stored with the lines.
+    """
+    key_prefix = None
+
+    def __init__(self, token, lines=None):
+        self.token = token
+        # line id -> {'product_id', 'color_id', 'size_id', 'quantity', 'added_at', 'updated_at'}
+        self.lines = lines or {}
+
+    @classmethod
+    def cache_key(cls, token):
+        return f'{cls.key_prefix}:{token}'
+
+    def timeout(self):
+        raise NotImplementedError
+
+    def dump(self):
+        return self.lines
+
+    def save(self):
+        cache.set(self.cache_key(self.token), self.dump(), self.timeout())
+
+    def commit(self):
+        """
+        Store a change made through the cart actions.
+        """
+        self.save()
+
+    def delete(self):
+        cache.delete(self.cache_key(self.token))
+        self.lines = {}
+
+    def quantity_of(self, product_id):
+        return sum(line['quantity'] for line in self.lines.values() if line['product_id'] == product_id)
+
+    def add(self, product_id, quantity, color_id=None, size_id=None):
+        now = int(timezone.now().timestamp())
+        line = self.lines.setdefault(line_id(product_id, color_id, size_id), {
+            'product_id': product_id, 'color_id': color_id, 'size_id': size_id,
+            'quantity': 0, 'added_at': now,
+        })
+        line['quantity'] += quantity
+        line['updated_at'] = now
+        return line
+
+    def set_quantity(self, key, quantity):
+        line = self.lines[key]
+        line['quantity'] = quantity
+        line['updated_at'] = int(timezone.now().timestamp())
+        return line
+
+    def remove(self, key):
+        return self.lines.pop(key, None)
+
+    def items(self):
+        """
+        Unsaved `CartItem`s for the lines, with products annotated for the lean
+        product card; three queries whatever the number of lines.
+        """
+        lines = list(self.lines.items())
+        products = Product.objects.with_rating_summary().with_feature_image().in_bulk(
+            {line['product_id'] for _, line in lines}
+        )
+        colors = ProductColor.objects.in_bulk({line['color_id'] for _, line in lines if line['color_id']})
+        sizes = ProductSize.objects.in_bulk({line['size_id'] for _, line in lines if line['size_id']})
+
+        items = []
+        for key, line in sorted(lines, key=lambda entry: entry[1]['added_at']):
+            product = products.get(line['product_id'])
+            if product is None:
+                continue
+            item = CartItem(
+                product=product,
+                quantity=line['quantity'],
+                selected_color=colors.get(line['color_id']),
+                selected_size=sizes.get(line['size_id']),
+                added_at=datetime.fromtimestamp(line['added_at'], tz=dt_timezone.utc),
+                updated_at=datetime.fromtimestamp(line['updated_at'], tz=dt_timezone.utc),
+            )
+            item.id = item.line_id = key
+            items.append(item)
+        return items
+
+
+class GuestCart(CachedCart):
+    key_prefix = 'orders:guest-cart'
+
+    def timeout(self):
+        return getattr(settings, 'GUEST_CART_TTL', 7 * 24 * 60 * 60)
+
+    @classmethod
+    def load(cls, token, create=False):
+        """
+        The cart stored under `token`; an empty new cart (with a fresh token
+        when `create` is set and the token is unknown) otherwise.
+        """
+        lines = cache.get(cls.cache_key(token)) if token else None
+        if lines is not None:
+            return cls(token, lines)
+        return cls(secrets.token_urlsafe(24) if create else token)
+
+    def merge_into(self, user):
+        """
+        Move the lines into `user`'s cart and drop the guest cart. Lines the
+        user already has are summed, capped at the product's stock.
+        """
+        if not self.lines:
+            return None
+        from .cart_buffer import settled  # cart_buffer builds on this module
+        with settled(user.pk), transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            existing = {
+                (item.product_id, item.selected_color_id, item.selected_size_id): item
+                for item in cart.items.all()
+            }
+            stock = dict(Product.objects.filter(
+                pk__in={line['product_id'] for line in self.lines.values()}
+            ).values_list('pk', 'stock'))
+
+            now = timezone.now()
+            new_items, changed_items = [], []
+            for line in self.lines.values():
+                if line['product_id'] not in stock:
+                    continue
+                available = stock[line['product_id']]
+                item = existing.get((line['product_id'], line['color_id'], line['size_id']))
+                if item is not None:
+                    merged = min(item.quantity + line['quantity'], max(available, item.quantity))
+                    if merged != item.quantity:
+                        item.quantity, item.updated_at = merged, now
+                        changed_items.append(item)
+                elif min(line['quantity'], available) > 0:
+                    new_items.append(CartItem(
+                        cart=cart, product_id=line['product_id'], quantity=min(line['quantity'], available),
+                        selected_color_id=line['color_id'], selected_size_id=line['size_id'],
+                    ))
+            if changed_items:
+                CartItem.objects.bulk_update(changed_items, ['quantity', 'updated_at'])
+            if new_items:
+                CartItem.objects.bulk_create(new_items)
+        self.delete()
+        return cart
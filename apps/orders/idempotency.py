@@ -0,0 +1,122 @@
+"""
+`Idempotency-Key` support for endpoints clients retry on timeouts.
+
+The first request with a given key claims a row in `IdempotencyKey` before
+running the view and stores its response afterwards; a retry with the same key
+and the same request gets that stored response back without touching the
+checkout or payment code. Keys live for `IDEMPOTENCY_KEY_TTL` seconds; the
+`purge_idempotency_keys` command deletes expired rows.
+
+A claim without a stored response is a lease: after
+`IDEMPOTENCY_IN_PROGRESS_TIMEOUT` seconds (default 60) the request holding it
+is presumed dead (e.g. its worker was killed) and a retry may take the key
+over. The timeout must exceed the slowest request it protects.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request):
+    data = request.data.lists() if hasattr(request.data, 'lists') else request.data.items()
+    payload = json.dumps([request.method, request.path, sorted(data)], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _lease():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 60))
+
+
+def _claim(user, key, fingerprint):
+    """
+    Insert the in-progress row for `key` and return (row, True); return
+    (existing row, False) instead when the key is already taken, unexpired
+    and, if still in progress, within its lease.
+    """
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+    now = timezone.now()
+    existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if existing is not None:
+        abandoned = existing.status_code is None and existing.created_at <= now - _lease()
+        if existing.expires_at > now and not abandoned:
+            return existing, False
+        # Conditional, so only one of several retries removes it.
+        IdempotencyKey.objects.filter(pk=existing.pk, status_code=existing.status_code).delete()
+    try:
+        with transaction.atomic():
+            row = IdempotencyKey.objects.create(
+                user=user, key=key, request_fingerprint=fingerprint, expires_at=now + timedelta(seconds=ttl)
+            )
+        return row, True
+    except IntegrityError:
+        # Lost the race to a concurrent request with the same key.
+        return IdempotencyKey.objects.filter(user=user, key=key).first(), False
+
+
+def idempotent(view_method):
+    """
+    Decorate a viewset action so requests carrying an `Idempotency-Key`
+    header run at most once per user and key. Requests without the header
+    are handled as before. Server errors are not stored, so they can be retried.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER, '').strip()
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"status": "error", "message": "Idempotency-Key نباید بیشتر از ۲۵۵ کاراکتر باشد"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = _fingerprint(request)
+        claim, claimed = _claim(request.user, key, fingerprint)
+        if not claimed:
+            existing = claim
+            if existing is not None and existing.request_fingerprint != fingerprint:
+                return Response(
+                    {"status": "error", "message": "این Idempotency-Key قبلاً برای درخواست دیگری استفاده شده است"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if existing is None or existing.status_code is None:
+                # None: the competing claim was released in the meantime.
+                response = Response(
+                    {"status": "error", "message": "درخواست قبلی با همین Idempotency-Key هنوز در حال پردازش است"},
+                    status=status.HTTP_409_CONFLICT
+                )
+                remaining = existing.created_at + _lease() - timezone.now() if existing else timedelta()
+                response['Retry-After'] = str(max(1, int(remaining.total_seconds()) + 1))
+                return response
+            response = Response(existing.response_body, status=existing.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        # By primary key: if the lease ran out and a retry took the key over,
+        # this request must not overwrite or delete the retry's row.
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(pk=claim.pk).delete()
+            raise
+
+        if response.status_code >= 500:
+            IdempotencyKey.objects.filter(pk=claim.pk).delete()
+        else:
+            IdempotencyKey.objects.filter(pk=claim.pk).update(
+                status_code=response.status_code, response_body=response.data
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.orders import cart_buffer
+
+
+class Command(BaseCommand):
+    help = "Write buffered cart changes to the database (CART_WRITE_BEHIND mode)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep running, flushing every CART_FLUSH_INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        interval = getattr(settings, 'CART_FLUSH_INTERVAL', 30)
+        while True:
+            flushed = cart_buffer.flush_pending()
+            self.stdout.write(self.style.SUCCESS(f"Flushed {flushed} buffered carts."))
+            if not options['loop']:
+                break
+            time.sleep(interval)
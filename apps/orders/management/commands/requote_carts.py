@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from apps.orders import cart_buffer, pricing
+
+
+class Command(BaseCommand):
+    help = (
+        "Requote every open cart at current prices, e.g. after a price change. "
+        "Writes one JSON line per cart (cart_id, user_id, subtotal, discount, shipping, "
+        "tax, total) to stdout or --output, and a summary to stderr."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', type=int, action='append', dest='product_ids',
+            help='Only carts holding this product id (repeatable)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts priced per query')
+        parser.add_argument('--output', help='File to write the quotes to instead of stdout')
+
+    def handle(self, *args, **options):
+        # Buffered carts (CART_WRITE_BEHIND) must reach the rows first.
+        if cart_buffer.is_enabled():
+            cart_buffer.flush_pending()
+
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else self.stdout
+        carts = 0
+        value = 0
+        try:
+            for cart_id, user_id, quote in pricing.quote_open_carts(options['product_ids'], options['batch_size']):
+                output.write(json.dumps({
+                    'cart_id': cart_id,
+                    'user_id': user_id,
+                    **{field: str(amount) for field, amount in quote._asdict().items()},
+                }) + '\n')
+                carts += 1
+                value += quote.total
+        finally:
+            if output is not self.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Requoted {carts} carts worth {value} in total."))
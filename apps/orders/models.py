@@ -1,8 +1,9 @@
-from django.db import models
-from django.utils.crypto import get_random_string
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
-from django.db.models import Q
-from apps.products.models import Color as ProductColor, Size as ProductSize
+from django.db.models import Count, DecimalField, F, Prefetch, Q, Sum
+from apps.products.models import Color as ProductColor, Product, Size as ProductSize
+from .order_numbers import next_order_number
 
 
 
@@ -47,11 +48,27 @@ class Order(models.Model):
     shipped_at = models.DateTimeField(blank=True, null=True)
     delivered_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_recent_idx'),
+            models.Index(fields=['user', 'status', '-created_at'], name='order_user_status_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.order_number:
-            self.order_number = get_random_string(10).upper()
         self.total = self.subtotal + self.shipping_cost + self.tax - self.discount
-        super().save(*args, **kwargs)
+        if self.order_number:
+            return super().save(*args, **kwargs)
+
+        self.order_number = next_order_number()
+        try:
+            with transaction.atomic():
+                return super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            # A clash should be impossible (see order_numbers); retry once anyway.
+            if 'order_number' not in str(exc):
+                raise
+        self.order_number = next_order_number()
+        return super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Order #{self.order_number} - {self.user.email if self.user else 'Guest'}"
@@ -88,6 +105,24 @@ class OrderItem(models.Model):
         return f"{self.quantity}x {self.product_name}{color_size_info} in Order #{self.order.order_number}"
     
 
+class CartItemQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Load what a cart line is rendered with: its color and size, and the
+        product as a lean catalog card.
+        """
+        products = Product.objects.with_rating_summary().with_feature_image()
+        return self.select_related('selected_color', 'selected_size').prefetch_related(
+            Prefetch('product', queryset=products)
+        )
+
+
+class CartQuerySet(models.QuerySet):
+    def with_lines(self):
+        items = CartItem.objects.with_details().order_by('added_at', 'id')
+        return self.prefetch_related(Prefetch('items', queryset=items))
+
+
 class Cart(models.Model):
     user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, null=True, blank=True)
     session_id = models.CharField(max_length=255, null=True, blank=True)  # For guest users
@@ -108,9 +143,33 @@ class Cart(models.Model):
             ),
         ]
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart: {self.user.email if self.user else self.session_id}"
 
+    def use_lines(self, items):
+        """
+        Serve `self.items.all()` from `items` (unsaved `CartItem`s, e.g. the
+        lines of a write-behind buffer) as if they had been prefetched, so the
+        cart serializes the same way as one loaded `with_lines()`.
+        """
+        lines = CartItem.objects.none()
+        lines._result_cache, lines._prefetch_done = list(items), True
+        self._prefetched_objects_cache = {'items': lines}
+        return self
+
+    def totals(self):
+        """
+        (total price, number of lines) in one aggregate query, for responses
+        that don't load the lines themselves.
+        """
+        totals = self.items.aggregate(
+            total=Sum(F('product__price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            item_count=Count('id'),
+        )
+        return totals['total'] or 0, totals['item_count']
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -122,6 +181,8 @@ class CartItem(models.Model):
     selected_color = models.ForeignKey(ProductColor, on_delete=models.SET_NULL, null=True, blank=True)
     selected_size = models.ForeignKey(ProductSize, on_delete=models.SET_NULL, null=True, blank=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product', 'selected_color', 'selected_size')
 
@@ -165,4 +226,78 @@ class Coupon(models.Model):
             self.is_active and 
             self.valid_from <= now <= self.valid_to and
             (self.usage_limit is None or self.used_count < self.usage_limit)
-        )
\ No newline at end of file
+        )
+
+    def redeem(self, order):
+        """
+        Claim one use of the coupon for `order`. The claim is a single
+        conditional UPDATE, so concurrent checkouts can't push `used_count` past
+        `usage_limit`. Returns False when no use is left. Call it inside the
+        transaction that creates the order.
+        """
+        claimed = Coupon.objects.filter(
+            Q(usage_limit__isnull=True) | Q(used_count__lt=F('usage_limit')),
+            pk=self.pk,
+            is_active=True,
+        ).update(used_count=F('used_count') + 1)
+        if not claimed:
+            return False
+        CouponRedemption.objects.create(coupon=self, order=order, user=order.user)
+        return True
+
+    @staticmethod
+    def release(order):
+        """
+        Give back the use `order` claimed, e.g. when it is cancelled. The ledger
+        row is deleted first, so an order can never release twice.
+        """
+        redemption = CouponRedemption.objects.filter(order=order).first()
+        if redemption is not None:
+            if not CouponRedemption.objects.filter(pk=redemption.pk).delete()[0]:
+                return
+            coupons = Coupon.objects.filter(pk=redemption.coupon_id)
+        elif order.promo_code and order.discount > 0:
+            # Orders placed before the ledger existed.
+            coupons = Coupon.objects.filter(code=order.promo_code)
+        else:
+            return
+        coupons.filter(used_count__gt=0).update(used_count=F('used_count') - 1)
+
+
+class CouponRedemption(models.Model):
+    """
+    Ledger of coupon uses, one row per order that redeemed a coupon.
+    """
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='redemptions')
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='coupon_redemption')
+    user = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='coupon_redemptions')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['coupon', 'user'])]
+
+    def __str__(self):
+        return f"{self.coupon.code} on Order #{self.order.order_number}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a request sent with an `Idempotency-Key` header, so a
+    retry gets the original response back instead of running again. A row
+    without a status code is a request still in progress.
+    """
+    user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_user_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
@@ -0,0 +1,148 @@
+"""
+Time-ordered order numbers.
+
+An order number packs a millisecond timestamp, a node id and a per-node
+sequence into one 63-bit integer (41 + 10 + 12 bits, like a Snowflake id),
+written as 13 zero-padded base-36 characters. They are generated in memory
+without a database round trip. New numbers sort by creation time, so
+inserts land at the end of the unique index on `order_number`, and a time
+range maps to an order number range (`bounds()`).
+
+Numbers are unique as long as no two running processes share a node id.
+Each process leases a free node from the shared cache (`cache.add`, renewed
+while in use, expiring `ORDER_NUMBER_NODE_LEASE` seconds after the last
+renewal). The cache must therefore be shared by all processes; without one,
+set `ORDER_NUMBER_NODE` (0-1023) to a distinct value per process instead.
+With neither, processes can pick the same node and numbers may clash: the
+`orders.W001` system check warns about it, and `check --deploy` fails
+(`orders.E001`).
+Within a node, the sequence allows 4096 numbers per millisecond, and the
+clock never runs backwards.
+
+Order numbers assigned before this scheme (10 random characters) are not
+time-ordered and are not covered by `bounds()`.
+"""
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+
+EPOCH_MS = int(datetime(2024, 1, 1, tzinfo=dt_timezone.utc).timestamp() * 1000)
+
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+WIDTH = 13
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def encode(value):
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(ALPHABET[remainder])
+    return ''.join(reversed(digits)).rjust(WIDTH, '0')
+
+
+def decode(order_number):
+    return int(order_number, 36)
+
+
+def _node_key(node):
+    return f'orders:order-number-node:{node}'
+
+
+def _lease_timeout():
+    return getattr(settings, 'ORDER_NUMBER_NODE_LEASE', 60 * 60)
+
+
+class OrderNumberGenerator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.node = None
+        self.lease = None
+        self.renewed_at = None
+        self.last_ms = -1
+        self.sequence = 0
+
+    def _lease_node(self):
+        """
+        Claim a node no other process holds. Raises RuntimeError when all
+        are taken.
+        """
+        self.lease = f'{socket.gethostname()}:{os.getpid()}:{get_random_string(8)}'
+        start = random.randrange(MAX_NODE + 1)
+        for offset in range(MAX_NODE + 1):
+            node = (start + offset) & MAX_NODE
+            if cache.add(_node_key(node), self.lease, _lease_timeout()):
+                self.node, self.renewed_at = node, time.monotonic()
+                return
+        raise RuntimeError("No free order number node; set ORDER_NUMBER_NODE per process")
+
+    def _ensure_node(self):
+        if self.pid != os.getpid():
+            # First use, or a forked worker: it needs a node of its own.
+            self.pid = os.getpid()
+            self.last_ms, self.sequence = -1, 0
+            configured = getattr(settings, 'ORDER_NUMBER_NODE', None)
+            if configured is not None:
+                self.node, self.lease = int(configured) & MAX_NODE, None
+            else:
+                self._lease_node()
+            return
+        if self.lease is None or time.monotonic() - self.renewed_at < _lease_timeout() / 2:
+            return
+        # Renew at half the lease, so the node can't expire while in use.
+        if cache.get(_node_key(self.node)) == self.lease:
+            cache.set(_node_key(self.node), self.lease, _lease_timeout())
+            self.renewed_at = time.monotonic()
+        else:
+            self._lease_node()
+
+    def __call__(self):
+        with self.lock:
+            self._ensure_node()
+
+            now_ms = max(int(time.time() * 1000) - EPOCH_MS, self.last_ms)
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond; wait for the next.
+                    while now_ms <= self.last_ms:
+                        now_ms = int(time.time() * 1000) - EPOCH_MS
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+
+            return encode((now_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self.sequence)
+
+
+next_order_number = OrderNumberGenerator()
+
+
+def created_at(order_number):
+    """
+    When a time-ordered order number was generated, as an aware datetime.
+    """
+    ms = (decode(order_number) >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=dt_timezone.utc)
+
+
+def bounds(start, end):
+    """
+    (low, high) order numbers such that `order_number__gte=low,
+    order_number__lt=high` selects orders numbered in [start, end).
+    """
+    def at(moment):
+        ms = max(int(moment.timestamp() * 1000) - EPOCH_MS, 0)
+        return encode(ms << (NODE_BITS + SEQUENCE_BITS))
+    return at(start), at(end)
@@ -0,0 +1,108 @@
+"""
+Pricing for carts, coupon quotes and checkout.
+
+A cart is a sequence of (price, quantity) lines. `quote_many()` prices any
+number of carts in one pass: the settings and the coupon terms are resolved
+once, then each cart is plain Decimal arithmetic. Every amount is rounded to
+cents (half up) as it is computed, so a quote always adds up:
+total = subtotal - discount + shipping + tax.
+
+Settings:
+
+- `ORDER_SHIPPING_COST`: flat shipping per non-empty cart (default 0).
+- `ORDER_FREE_SHIPPING_OVER`: subtotal from which shipping is free (default
+  None, never).
+- `ORDER_TAX_RATE`: tax as a fraction of the discounted subtotal, e.g.
+  "0.09" (default 0).
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+
+from .models import CartItem
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+Quote = namedtuple('Quote', ['subtotal', 'discount', 'shipping', 'tax', 'total'])
+
+
+def money(value):
+    if isinstance(value, float):
+        value = str(value)
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def coupon_terms(coupon):
+    """
+    (is_percentage, amount, min_purchase, max_discount) of a coupon, or None.
+    """
+    if coupon is None:
+        return None
+    max_discount = coupon.max_discount if coupon.max_discount and coupon.max_discount > 0 else None
+    return coupon.is_percentage, Decimal(coupon.amount), Decimal(coupon.min_purchase or 0), max_discount
+
+
+def _discount(terms, subtotal):
+    if terms is None or subtotal <= 0:
+        return ZERO
+    is_percentage, amount, min_purchase, max_discount = terms
+    if subtotal < min_purchase:
+        return ZERO
+    discount = subtotal * amount / 100 if is_percentage else amount
+    if max_discount is not None:
+        discount = min(discount, max_discount)
+    return money(min(discount, subtotal))
+
+
+def quote_many(carts, coupon=None):
+    """
+    Price each cart in `carts` (an iterable of line sequences) and return a
+    list of `Quote`s in the same order. `coupon` applies to every cart.
+    """
+    terms = coupon_terms(coupon)
+    shipping_cost = money(getattr(settings, 'ORDER_SHIPPING_COST', 0))
+    free_over = getattr(settings, 'ORDER_FREE_SHIPPING_OVER', None)
+    free_over = money(free_over) if free_over is not None else None
+    tax_rate = Decimal(str(getattr(settings, 'ORDER_TAX_RATE', 0)))
+
+    quotes = []
+    for lines in carts:
+        subtotal = money(sum((Decimal(price) * quantity for price, quantity in lines), ZERO))
+        discount = _discount(terms, subtotal)
+        if subtotal <= 0 or (free_over is not None and subtotal >= free_over):
+            shipping = ZERO
+        else:
+            shipping = shipping_cost
+        tax = money((subtotal - discount) * tax_rate)
+        quotes.append(Quote(subtotal, discount, shipping, tax, subtotal - discount + shipping + tax))
+    return quotes
+
+
+def quote(lines, coupon=None):
+    return quote_many([lines], coupon)[0]
+
+
+def quote_open_carts(product_ids=None, batch_size=1000):
+    """
+    Yield (cart_id, user_id, Quote) for every cart with lines, or only those
+    holding one of `product_ids`, at current prices. One query per batch.
+    """
+    carts = CartItem.objects.order_by('cart_id').values_list('cart_id', flat=True).distinct()
+    if product_ids:
+        carts = carts.filter(product_id__in=product_ids)
+    cart_ids = list(carts)
+
+    for start in range(0, len(cart_ids), batch_size):
+        batch = cart_ids[start:start + batch_size]
+        lines, owners = {}, {}
+        rows = CartItem.objects.filter(cart_id__in=batch).values_list(
+            'cart_id', 'cart__user_id', 'product__price', 'quantity'
+        )
+        for cart_id, user_id, price, quantity in rows:
+            lines.setdefault(cart_id, []).append((price, quantity))
+            owners[cart_id] = user_id
+        quoted = list(lines)
+        for cart_id, cart_quote in zip(quoted, quote_many(lines[cart_id] for cart_id in quoted)):
+            yield cart_id, owners[cart_id], cart_quote
@@ -1,8 +1,8 @@
 from rest_framework import serializers
 from .models import Order, OrderItem, Cart, CartItem, Coupon
-from apps.products.serializers import ProductSerializer
+from .guest_cart import line_id
 from django.utils import timezone
-from apps.products.serializers import ProductSerializer, ColorSerializer as ProductColorSerializer, SizeSerializer as ProductSizeSerializer
+from apps.products.serializers import ProductListSerializer, ColorSerializer as ProductColorSerializer, SizeSerializer as ProductSizeSerializer
 from apps.products.models import Product
 import calendar
 from datetime import datetime
@@ -79,8 +79,22 @@ class PaymentUpdateSerializer(serializers.Serializer):
             raise serializers.ValidationError("وضعیت پرداخت باید 'paid' یا 'failed' باشد")
         return value
 
+class CartProductSerializer(ProductListSerializer):
+    class Meta(ProductListSerializer.Meta):
+        fields = ProductListSerializer.Meta.fields + ['stock']
+        read_only_fields = fields
+
+
 class CartItemSerializer(serializers.ModelSerializer):
-    product_details = ProductSerializer(source='product', read_only=True)
+    """
+    Cart line with a lean product card. Expects items loaded with
+    `CartItem.objects.with_details()`.
+
+    `line_id` (`<product>-<color>-<size>`) names the line whether or not it is
+    stored as a row yet; cart endpoints accept it wherever they take an item id.
+    """
+    line_id = serializers.SerializerMethodField()
+    product_details = CartProductSerializer(source='product', read_only=True)
     selected_color = ProductColorSerializer(read_only=True)
     selected_size = ProductSizeSerializer(read_only=True)
     
@@ -90,16 +104,29 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = [
-            'id', 'product', 'product_details', 'quantity', 'added_at', 'updated_at',
+            'id', 'line_id', 'product', 'product_details', 'quantity', 'added_at', 'updated_at',
             'selected_color', 'selected_size'
         ]
         read_only_fields = ['added_at', 'updated_at']
     
+    def get_line_id(self, obj):
+        # Lines of cached carts carry the key they are stored under.
+        if hasattr(obj, 'line_id'):
+            return obj.line_id
+        return line_id(obj.product_id, obj.selected_color_id, obj.selected_size_id)
+    
     def validate_quantity(self, value):
         if value <= 0:
             raise serializers.ValidationError("تعداد محصول باید بیشتر از صفر باشد")
         return value
 
+class GuestCartItemSerializer(CartItemSerializer):
+    """
+    Line of a guest cart; its id is the line key used in guest cart URLs.
+    """
+    id = serializers.CharField(read_only=True)
+
+
 class CartItemAddSerializer(serializers.Serializer):
     product_id = serializers.IntegerField(min_value=1)
     quantity = serializers.IntegerField(min_value=1)
@@ -150,7 +177,38 @@ class CartItemQuantitySerializer(serializers.Serializer):
             raise serializers.ValidationError("تعداد برای کم کردن باید بیشتر از صفر باشد")
         return value
 
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['add', 'update', 'remove']
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product_id = serializers.IntegerField(min_value=1, required=False)
+    # The line's id or its line_id.
+    item_id = serializers.RegexField(r'^(\d+|\d+-\d+-\d+)$', required=False)
+    quantity = serializers.IntegerField(min_value=1, required=False)
+    color_id = serializers.IntegerField(required=False, allow_null=True)
+    size_id = serializers.IntegerField(required=False, allow_null=True)
+
+    def validate(self, data):
+        required = {
+            'add': ['product_id', 'quantity'],
+            'update': ['item_id', 'quantity'],
+            'remove': ['item_id'],
+        }[data['op']]
+        missing = [field for field in required if field not in data]
+        if missing:
+            raise serializers.ValidationError(f"برای عملیات '{data['op']}' فیلدهای {', '.join(missing)} الزامی است")
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=50)
+
+
 class CartSerializer(serializers.ModelSerializer):
+    """
+    Full cart. Expects a cart loaded with `Cart.objects.with_lines()`; the
+    total and item count are computed from those lines in the same pass.
+    """
     items = CartItemSerializer(many=True, read_only=True)
     total = serializers.SerializerMethodField()
     item_count = serializers.SerializerMethodField()
@@ -164,14 +222,22 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at', 'updated_at']
     
     def get_total(self, obj):
-        try:
-            total = sum(item.product.price * item.quantity for item in obj.items.all())
-            return int(total)
-        except:
-            return 0
+        return int(sum(item.product.price * item.quantity for item in obj.items.all()))
     
     def get_item_count(self, obj):
-        return obj.items.count()
+        return len(obj.items.all())
+
+
+class CartDeltaSerializer(serializers.Serializer):
+    """
+    Response of a cart mutation in delta mode: the line that changed (or the id
+    of the one removed) plus the new cart totals, instead of the whole cart.
+    """
+    item = CartItemSerializer(allow_null=True)
+    removed_item_id = serializers.IntegerField(allow_null=True)
+    removed_line_id = serializers.CharField(allow_null=True)
+    total = serializers.IntegerField()
+    item_count = serializers.IntegerField()
 
 class CouponSerializer(serializers.ModelSerializer):
     discount_type = serializers.SerializerMethodField()
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.accounts.models import UserAddress
+
+from . import tracking
+from .coupons import coupon_index
+from .models import Coupon, Order, OrderItem
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def expire_order_tracking(sender, instance, **kwargs):
+    order_id = instance.pk
+    transaction.on_commit(lambda: tracking.invalidate(order_id))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def expire_item_order_tracking(sender, instance, **kwargs):
+    order_id = instance.order_id
+    transaction.on_commit(lambda: tracking.invalidate(order_id))
+
+
+@receiver(post_save, sender=UserAddress)
+def expire_address_order_tracking(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    order_ids = list(Order.objects.filter(shipping_address=instance).values_list('pk', flat=True))
+    if order_ids:
+        transaction.on_commit(lambda: tracking.invalidate(*order_ids))
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupon_index(sender, instance, **kwargs):
+    transaction.on_commit(coupon_index.invalidate)
@@ -0,0 +1,122 @@
+import multiprocessing
+import queue
+import unittest
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User, UserAddress
+from apps.products.models import Brand, Category, Gender, Product
+
+from . import cart_buffer
+from .guest_cart import line_id
+from .models import Cart, CartItem, Order, OrderItem
+
+
+def checkout(barrier, results, node, user_id, address_id):
+    # Runs in a forked worker: a connection of its own, a node of its own.
+    connection.close()
+    try:
+        with override_settings(ORDER_NUMBER_NODE=node):
+            client = APIClient()
+            client.force_authenticate(User.objects.get(pk=user_id))
+            barrier.wait()
+            response = client.post('/api/orders/cart/checkout/', {'address_id': address_id})
+        results.put(response.status_code)
+    finally:
+        connection.close()
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "needs fork")
+class ConcurrentCheckoutTests(TransactionTestCase):
+    shoppers = 8
+    stock = 3
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Shoes'),
+            brand=Brand.objects.create(name='Acme'),
+            gender=Gender.objects.create(name='Men'),
+            name='Runner', description='A running shoe', price=Decimal('100.00'), stock=self.stock,
+        )
+        self.users = []
+        for index in range(self.shoppers):
+            user = User.objects.create_user(f'shopper{index}', f'shopper{index}@example.com', 'pw')
+            address = UserAddress.objects.create(user=user, address='Street 1', city='City', postal_code='1', country='IR')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.users.append((user, address))
+
+    def checkout_all(self):
+        """
+        Check every shopper out at once, each from its own process, like
+        separate app servers sharing the (file-backed) test database.
+        """
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(self.shoppers)
+        results = context.Queue()
+        connection.close()
+        workers = [
+            context.Process(target=checkout, args=(barrier, results, node, user.pk, address.pk))
+            for node, (user, address) in enumerate(self.users)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+        statuses = []
+        for _ in workers:
+            try:
+                statuses.append(results.get(timeout=5))
+            except queue.Empty:
+                break
+        return statuses
+
+    def test_parallel_checkouts_cannot_oversell(self):
+        statuses = self.checkout_all()
+
+        self.assertEqual(len(statuses), self.shoppers)
+        self.assertEqual(statuses.count(201), self.stock)
+        self.assertEqual(statuses.count(400), self.shoppers - self.stock)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+        # Failed checkouts leave nothing behind and keep their carts.
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(OrderItem.objects.count(), self.stock)
+        self.assertEqual(sum(OrderItem.objects.values_list('quantity', flat=True)), self.stock)
+        self.assertEqual(CartItem.objects.count(), self.shoppers - self.stock)
+
+
+@override_settings(CART_WRITE_BEHIND=True)
+class CartBufferFlushTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        category = Category.objects.create(name='Shoes')
+        brand = Brand.objects.create(name='Acme')
+        gender = Gender.objects.create(name='Men')
+        self.kept, self.deleted = [
+            Product.objects.create(
+                category=category, brand=brand, gender=gender,
+                name=name, description='A shoe', price=Decimal('100.00'), stock=5,
+            )
+            for name in ('Runner', 'Walker')
+        ]
+
+    def test_flush_drops_lines_of_deleted_products(self):
+        with cart_buffer.editing(self.user.pk) as cart:
+            cart.add(self.kept.pk, 2)
+            cart.add(self.deleted.pk, 1)
+            cart.commit()
+        self.deleted.delete()
+
+        self.assertEqual(cart_buffer.flush_pending(), 1)
+
+        rows = CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')
+        self.assertEqual(list(rows), [(self.kept.pk, 2)])
+        self.assertEqual(list(cart_buffer.BufferedCart.load(self.user.pk).lines), [line_id(self.kept.pk)])
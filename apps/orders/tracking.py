@@ -0,0 +1,89 @@
+"""
+Cached tracking snapshots of orders.
+
+`track` is polled far more often than orders change, so its payload is built
+once per order and kept in the cache until the signal handlers in `signals.py`
+drop it: on any save of the order (status, payment, shipping updates), of its
+items or of its shipping address. They drop it once the transaction commits,
+so a snapshot rebuilt before the change was visible cannot outlive it. The
+owner's id is stored alongside the payload, so a cache hit is answered
+without touching the database.
+"""
+import calendar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .serializers import OrderItemSerializer
+
+ESTIMATED_DELIVERY_DAYS = 3
+
+
+def _key(order_id):
+    return f'orders:tracking:{order_id}'
+
+
+def _timestamp(value):
+    return int(calendar.timegm(value.utctimetuple())) if value else None
+
+
+def _shipping_address(address):
+    if address is None:
+        return None
+    return {
+        "full_name": f"{address.user.first_name} {address.user.last_name}",
+        "address": address.address,
+        "country": address.country,
+        "city": address.city,
+        "postal_code": address.postal_code,
+        "email": address.user.email,
+    }
+
+
+def build_snapshot(order):
+    """
+    Tracking payload of `order`, loaded with `shipping_address__user` and `items`.
+    """
+    estimated_delivery = None
+    if order.shipped_at:
+        estimated_delivery = order.shipped_at + timezone.timedelta(days=ESTIMATED_DELIVERY_DAYS)
+
+    return {
+        "order_id": order.id,
+        "order_number": order.order_number,
+        "status": order.status,
+        "status_display": order.get_status_display(),
+        "created_at": _timestamp(order.created_at),
+        "updated_at": _timestamp(order.updated_at),
+        "is_paid": order.payment_status == 'paid',
+        "payment_method": order.payment_method,
+        "payment_date": _timestamp(order.payment_date),
+        "transaction_id": order.transaction_id,
+        "shipping_address": _shipping_address(order.shipping_address),
+        "tracking_number": order.tracking_number,
+        "shipped_at": _timestamp(order.shipped_at),
+        "delivered_at": _timestamp(order.delivered_at),
+        "estimated_delivery": _timestamp(estimated_delivery),
+        "items": OrderItemSerializer(order.items.all(), many=True).data,
+    }
+
+
+def get_snapshot(order_id, user_id):
+    """
+    Cached payload of the order, or None when it isn't cached or belongs to
+    another user.
+    """
+    entry = cache.get(_key(order_id))
+    if entry is None or entry['user_id'] != user_id:
+        return None
+    return entry['payload']
+
+
+def set_snapshot(order, payload):
+    timeout = getattr(settings, 'ORDER_TRACKING_CACHE_TIMEOUT', 10 * 60)
+    cache.set(_key(order.id), {'user_id': order.user_id, 'payload': payload}, timeout)
+
+
+def invalidate(*order_ids):
+    cache.delete_many([_key(order_id) for order_id in order_ids])
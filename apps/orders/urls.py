@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, CartViewSet, CouponViewSet
+from .views import OrderViewSet, CartViewSet, GuestCartViewSet, CouponViewSet
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'cart', CartViewSet, basename='cart')
+router.register(r'guest-cart', GuestCartViewSet, basename='guest-cart')
 router.register(r'coupons', CouponViewSet, basename='coupon')
 
 urlpatterns = [
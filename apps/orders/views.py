@@ -1,5 +1,5 @@
 from rest_framework import viewsets, permissions, status
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
@@ -7,12 +7,43 @@ from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from django.db import transaction
-from decimal import Decimal
 
 from .models import *  
 from apps.products.models import Color as ProductColor, Size as ProductSize 
+from apps.products import product_cache
+from apps.products.conditional import bump_version
 
 from .serializers import *
+from .idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from .pagination import OrderCursorPagination
+from .filters import OrderHistoryFilter
+from . import tracking
+from .guest_cart import HEADER as GUEST_CART_HEADER, GuestCart
+from . import cart_buffer
+from .cart_buffer import BufferedCart
+from . import guest_cart
+from . import coupons
+from .coupons import coupon_index
+from . import pricing
+
+
+IDEMPOTENCY_PARAMETER = openapi.Parameter(
+    IDEMPOTENCY_HEADER, openapi.IN_HEADER,
+    description="Client-generated unique key; retries with the same key return the original response instead of running again",
+    type=openapi.TYPE_STRING
+)
+
+GUEST_CART_PARAMETER = openapi.Parameter(
+    GUEST_CART_HEADER, openapi.IN_HEADER,
+    description="Guest cart token returned by the first add to the guest cart",
+    type=openapi.TYPE_STRING
+)
+
+DELTA_PARAMETER = openapi.Parameter(
+    'delta', openapi.IN_QUERY,
+    description="Set to 1 to get only the changed line and the new totals instead of the whole cart",
+    type=openapi.TYPE_INTEGER
+)
 
 
 
@@ -35,7 +66,8 @@ from .serializers import *
 class OrderViewSet(viewsets.GenericViewSet):
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser) 
-    pagination_class = None
+    pagination_class = OrderCursorPagination
+    filter_backends = [OrderHistoryFilter]
     
     def get_serializer_class(self):
         if self.action == 'cancel':
@@ -52,16 +84,27 @@ class OrderViewSet(viewsets.GenericViewSet):
             return Order.objects.filter(user=user)
         return Order.objects.none()  
     
+    def with_details(self, queryset):
+        return queryset.select_related('shipping_address__user').prefetch_related('items')
+    
     @swagger_auto_schema(
         operation_summary="Get all orders",
-        operation_description="Retrieve all orders for the current user",
+        operation_description="Retrieve the current user's orders, newest first, cursor-paginated. Follow the `next` link to fetch the following page.",
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor taken from the previous page", type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description="Number of orders per page (max 100)", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('status', openapi.IN_QUERY, description="Comma separated statuses", type=openapi.TYPE_STRING),
+            openapi.Parameter('created_after', openapi.IN_QUERY, description="Unix timestamp; orders created at or after it", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('created_before', openapi.IN_QUERY, description="Unix timestamp; orders created before it", type=openapi.TYPE_INTEGER),
+        ],
         tags=["Orders"]
     )
     @action(detail=False, methods=['get'], url_path='')
     def list_orders(self, request):
-        queryset = self.get_queryset().order_by('-created_at')
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = self.with_details(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        serializer = OrderSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @swagger_auto_schema(
         operation_summary="Get order details",
@@ -70,7 +113,7 @@ class OrderViewSet(viewsets.GenericViewSet):
     )
     @action(detail=True, methods=['get'], url_path='')
     def get_order(self, request, pk=None):
-        order = get_object_or_404(self.get_queryset(), pk=pk)
+        order = get_object_or_404(self.with_details(self.get_queryset()), pk=pk)
         serializer = OrderSerializer(order)
         return Response(serializer.data)
     
@@ -91,23 +134,29 @@ class OrderViewSet(viewsets.GenericViewSet):
         
         if order.status in cancellable_statuses:
             with transaction.atomic():
+                # Conditional UPDATE, so two concurrent cancels restock once.
+                cancelled = Order.objects.filter(pk=order.pk, status__in=cancellable_statuses).update(status='cancelled')
+                if not cancelled:
+                    order.refresh_from_db(fields=['status'])
+                    return Response(
+                        {"status": "error", "message": f"سفارش با وضعیت '{order.get_status_display()}' قابل لغو نیست."},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
                 order.status = 'cancelled'
-                order.save(update_fields=['status'])
+                transaction.on_commit(lambda: tracking.invalidate(order.pk))
 
-                for item in order.items.all():
-                    if item.product:
-                        product_to_update = item.product
-                        product_to_update.stock += item.quantity
-                        product_to_update.save(update_fields=['stock'])
+                quantities = {}
+                for product_id, quantity in order.items.filter(product__isnull=False).values_list('product_id', 'quantity'):
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
+                Product.objects.increment_stock(quantities)
+                # The stock UPDATE skips Product signals: expire what shows stock.
+                slugs = set(Product.objects.filter(pk__in=quantities).values_list('slug', flat=True))
+                transaction.on_commit(lambda: product_cache.invalidate_product(*slugs))
+                transaction.on_commit(lambda: bump_version('products'))
                 
-                if order.promo_code and order.discount > 0:
-                    try:
-                        coupon = Coupon.objects.get(code=order.promo_code)
-                        if coupon.used_count > 0:
-                            coupon.used_count -= 1
-                            coupon.save(update_fields=['used_count'])
-                    except Coupon.DoesNotExist:
-                        pass 
+                Coupon.release(order)
+                if order.promo_code:
+                    transaction.on_commit(coupon_index.invalidate)
 
             return Response({"status": "success", "message": "سفارش با موفقیت لغو شد."})
         
@@ -125,9 +174,11 @@ class OrderViewSet(viewsets.GenericViewSet):
             400: openapi.Response("Invalid request or order status"),
             404: openapi.Response("Order not found")
         },
+        manual_parameters=[IDEMPOTENCY_PARAMETER],
         tags=["Orders"]
     )
     @action(detail=True, methods=['post'], url_path='payment')
+    @idempotent
     def update_payment(self, request, pk=None):
         order = get_object_or_404(self.get_queryset(), pk=pk)
         serializer = PaymentUpdateSerializer(data=request.data)
@@ -185,36 +236,126 @@ class OrderViewSet(viewsets.GenericViewSet):
     )
     @action(detail=True, methods=['get'], url_path='track')
     def track_order(self, request, pk=None):
-        order = get_object_or_404(self.get_queryset(), pk=pk)
+        payload = tracking.get_snapshot(pk, request.user.pk)
+        if payload is None:
+            order = get_object_or_404(self.with_details(self.get_queryset()), pk=pk)
+            payload = tracking.build_snapshot(order)
+            tracking.set_snapshot(order, payload)
+        return Response(payload)
+
+
+class CachedCartMixin:
+    """
+    Cart actions applied to a cart held in the cache (`guest_cart.CachedCart`)
+    instead of `CartItem` rows: guest carts, and user carts in write-behind
+    mode. Lines are addressed by their line id; `changed` and `removed` name
+    the line a mutation touched.
+    """
+    def cached_cart_response(self, cart, changed=None, removed=None):
+        items = cart.items()
+        return Response({
+            "items": GuestCartItemSerializer(items, many=True, context=self.get_serializer_context()).data,
+            "total": int(sum(item.product.price * item.quantity for item in items)),
+            "item_count": len(items),
+        })
+    
+    def cached_line_key(self, cart, item_id):
+        """
+        Key in `cart.lines` of the line the client addressed as `item_id`.
+        """
+        return item_id
+    
+    def cached_line_not_found(self):
+        return Response(
+            {"status": "error", "message": "آیتم در سبد خرید پیدا نشد"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    def cached_product_not_found(self):
+        return Response(
+            {"status": "error", "message": "محصول یافت نشد."},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    def cached_stock_error(self, product, in_cart):
+        return Response({
+            "status": "error", 
+            "message": f"موجودی کافی نیست. موجودی انبار: {product.stock} عدد، موجودی در سبد شما: {in_cart} عدد، حداکثر قابل اضافه کردن: {max(0, product.stock - in_cart)} عدد"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    def cached_add_item(self, cart, request):
+        serializer = CartItemAddSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
         
-        estimated_delivery_timestamp = None
-        if order.shipped_at:
-            estimated_delivery_date = order.shipped_at + timezone.timedelta(days=3)
-            estimated_delivery_timestamp = int(calendar.timegm(estimated_delivery_date.utctimetuple()))
-        
-        tracking_info = {
-            "order_id": order.id,
-            "order_number": order.order_number,
-            "status": order.status,
-            "status_display": order.get_status_display(),
-            "created_at": int(calendar.timegm(order.created_at.utctimetuple())),
-            "updated_at": int(calendar.timegm(order.updated_at.utctimetuple())),
-            "is_paid": order.payment_status == 'paid', 
-            "payment_method": order.payment_method,
-            "payment_date": int(calendar.timegm(order.payment_date.utctimetuple())) if order.payment_date else None,
-            "transaction_id": order.transaction_id,
-            "shipping_address": OrderSerializer(order).data.get('shipping_address_details'), 
-            "tracking_number": order.tracking_number,
-            "shipped_at": int(calendar.timegm(order.shipped_at.utctimetuple())) if order.shipped_at else None,
-            "delivered_at": int(calendar.timegm(order.delivered_at.utctimetuple())) if order.delivered_at else None,
-            "estimated_delivery": estimated_delivery_timestamp,
-            "items": OrderItemSerializer(order.items.all(), many=True).data 
-        }
+        product = Product.objects.only('id', 'stock').filter(pk=data['product_id']).first()
+        if product is None:
+            return self.cached_product_not_found()
+        in_cart = cart.quantity_of(product.id)
+        if in_cart + data['quantity'] > product.stock:
+            return self.cached_stock_error(product, in_cart)
+        
+        color_id, size_id = data.get('color_id') or None, data.get('size_id') or None
+        cart.add(product.id, data['quantity'], color_id, size_id)
+        cart.commit()
+        return self.cached_cart_response(cart, changed=guest_cart.line_id(product.id, color_id, size_id))
+    
+    def cached_update_item(self, cart, request, line_id):
+        serializer = CartItemUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response(tracking_info)
+        line_id = self.cached_line_key(cart, line_id)
+        line = cart.lines.get(line_id)
+        if line is None:
+            return self.cached_line_not_found()
+        
+        quantity = serializer.validated_data['quantity']
+        product = Product.objects.only('id', 'stock').filter(pk=line['product_id']).first()
+        if product is None:
+            return self.cached_product_not_found()
+        in_cart = cart.quantity_of(product.id) - line['quantity']
+        if in_cart + quantity > product.stock:
+            return self.cached_stock_error(product, in_cart)
+        
+        cart.set_quantity(line_id, quantity)
+        cart.commit()
+        return self.cached_cart_response(cart, changed=line_id)
+    
+    def cached_decrease_item(self, cart, request, line_id):
+        serializer = CartItemQuantitySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        line_id = self.cached_line_key(cart, line_id)
+        line = cart.lines.get(line_id)
+        if line is None:
+            return self.cached_line_not_found()
+        
+        decrease_by = serializer.validated_data['quantity']
+        if line['quantity'] > decrease_by:
+            cart.set_quantity(line_id, line['quantity'] - decrease_by)
+            cart.commit()
+            return self.cached_cart_response(cart, changed=line_id)
+        cart.remove(line_id)
+        cart.commit()
+        return self.cached_cart_response(cart, removed=line_id)
+    
+    def cached_remove_item(self, cart, line_id):
+        line_id = self.cached_line_key(cart, line_id)
+        if cart.remove(line_id) is None:
+            return self.cached_line_not_found()
+        cart.commit()
+        return self.cached_cart_response(cart, removed=line_id)
+    
+    def cached_clear(self, cart):
+        cart.lines = {}
+        cart.commit()
+        return self.cached_cart_response(cart)
 
 
-class CartViewSet(viewsets.GenericViewSet):
+class CartViewSet(CachedCartMixin, viewsets.GenericViewSet):
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser) 
     pagination_class = None
@@ -235,6 +376,89 @@ class CartViewSet(viewsets.GenericViewSet):
             return Cart.objects.none()
         return Cart.objects.filter(user=self.request.user)
     
+    def wants_delta(self):
+        return self.request.query_params.get('delta') in ('1', 'true')
+    
+    @staticmethod
+    def line_id_of(item):
+        return guest_cart.line_id(item.product_id, item.selected_color_id, item.selected_size_id)
+    
+    def get_cart_item(self, cart, item_id):
+        """
+        The cart's line addressed by its id or by its line id; raises
+        CartItem.DoesNotExist.
+        """
+        if str(item_id).isdigit():
+            return CartItem.objects.get(cart=cart, pk=item_id)
+        parsed = guest_cart.parse_line_id(item_id)
+        if parsed is None:
+            raise CartItem.DoesNotExist
+        product_id, color_id, size_id = parsed
+        return CartItem.objects.get(
+            cart=cart, product_id=product_id, selected_color_id=color_id, selected_size_id=size_id
+        )
+    
+    def cart_response(self, cart, item=None, removed_item_id=None, removed_line_id=None):
+        """
+        Respond to a cart mutation with the whole cart, or with `?delta=1` with
+        just the changed line and the new totals.
+        """
+        if cart_buffer.is_enabled():
+            return self.cached_cart_response(BufferedCart.load(self.request.user.pk))
+        
+        context = self.get_serializer_context()
+        if self.wants_delta():
+            if item is not None:
+                item = CartItem.objects.with_details().get(pk=item.pk)
+            total, item_count = cart.totals()
+            delta = {
+                'item': item, 'removed_item_id': removed_item_id, 'removed_line_id': removed_line_id,
+                'total': int(total), 'item_count': item_count,
+            }
+            return Response(CartDeltaSerializer(delta, context=context).data)
+        
+        cart = Cart.objects.with_lines().get(pk=cart.pk)
+        return Response(CartSerializer(cart, context=context).data)
+    
+    def cached_line_key(self, cart, item_id):
+        """
+        Buffered lines are addressed by line id, or by the id of the row they
+        were flushed to.
+        """
+        if str(item_id).isdigit():
+            row = CartItem.objects.filter(pk=item_id, cart__user_id=cart.token).first()
+            return self.line_id_of(row) if row else None
+        return item_id
+    
+    def cached_cart_response(self, cart, changed=None, removed=None):
+        """
+        A buffered cart in the same shapes as `cart_response()`, so clients
+        see one contract whether or not write-behind is enabled.
+        """
+        items = cart.items()
+        context = self.get_serializer_context()
+        if self.wants_delta():
+            removed_item_id = None
+            if removed is not None:
+                # The row, if the line had been flushed; the next flush deletes it.
+                product_id, color_id, size_id = guest_cart.parse_line_id(removed)
+                removed_item_id = CartItem.objects.filter(
+                    cart__user_id=cart.token, product_id=product_id,
+                    selected_color_id=color_id, selected_size_id=size_id,
+                ).values_list('id', flat=True).first()
+            delta = {
+                'item': next((item for item in items if item.line_id == changed), None),
+                'removed_item_id': removed_item_id, 'removed_line_id': removed,
+                'total': int(sum(item.product.price * item.quantity for item in items)),
+                'item_count': len(items),
+            }
+            return Response(CartDeltaSerializer(delta, context=context).data)
+        return self.buffered_cart_response(items)
+    
+    def buffered_cart_response(self, items):
+        cart, created = Cart.objects.get_or_create(user=self.request.user)
+        return Response(CartSerializer(cart.use_lines(items), context=self.get_serializer_context()).data)
+    
     
     @swagger_auto_schema(
         operation_summary="Get user's cart",
@@ -244,8 +468,10 @@ class CartViewSet(viewsets.GenericViewSet):
     )
     @action(detail=False, methods=['get'], url_path='')
     def get_cart(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        if cart_buffer.is_enabled():
+            return self.buffered_cart_response(BufferedCart.load(request.user.pk).items())
+        cart, created = Cart.objects.with_lines().get_or_create(user=request.user)
+        serializer = CartSerializer(cart, context=self.get_serializer_context())
         return Response(serializer.data)
     
     @swagger_auto_schema(
@@ -253,10 +479,14 @@ class CartViewSet(viewsets.GenericViewSet):
         operation_description="Add a product to the user's cart or increase quantity if already exists. Specify color_id and size_id if applicable.",
         request_body=CartItemAddSerializer,
         responses={200: CartSerializer()},
+        manual_parameters=[DELTA_PARAMETER],
         tags=["Cart"]
     )
     @action(detail=False, methods=['post'], url_path='items')
     def add_item(self, request):
+        if cart_buffer.is_enabled():
+            with cart_buffer.editing(request.user.pk) as cart:
+                return self.cached_add_item(cart, request)
         cart, created = Cart.objects.get_or_create(user=request.user)
         serializer = CartItemAddSerializer(data=request.data)
         
@@ -314,7 +544,7 @@ class CartViewSet(viewsets.GenericViewSet):
             existing_item.quantity = final_quantity
             existing_item.save(update_fields=['quantity', 'updated_at'])
         else:
-            CartItem.objects.create(
+            existing_item = CartItem.objects.create(
                 cart=cart,
                 product=product,
                 quantity=quantity,
@@ -322,18 +552,21 @@ class CartViewSet(viewsets.GenericViewSet):
                 selected_size=selected_size_obj
             )
         
-        result_serializer = CartSerializer(cart)
-        return Response(result_serializer.data)
+        return self.cart_response(cart, item=existing_item)
     
     @swagger_auto_schema(
         operation_summary="Update cart item quantity", 
-        operation_description="Update the quantity of a product in the cart. To change color/size, remove and re-add the item.",
+        operation_description="Update the quantity of a product in the cart, addressed by the line's id or its line_id. To change color/size, remove and re-add the item.",
         request_body=CartItemUpdateSerializer, 
         responses={200: CartSerializer()},
+        manual_parameters=[DELTA_PARAMETER],
         tags=["Cart"]
     )
     @action(detail=True, methods=['put'], url_path='items/(?P<item_id>[^/.]+)')
     def update_item(self, request, item_id=None, **kwargs):
+        if cart_buffer.is_enabled():
+            with cart_buffer.editing(request.user.pk) as cart:
+                return self.cached_update_item(cart, request, item_id)
         cart, created = Cart.objects.get_or_create(user=request.user)
         serializer = CartItemUpdateSerializer(data=request.data)
         
@@ -343,7 +576,7 @@ class CartViewSet(viewsets.GenericViewSet):
         quantity = serializer.validated_data['quantity']
         
         try:
-            item = CartItem.objects.get(id=item_id, cart=cart)
+            item = self.get_cart_item(cart, item_id)
             if quantity > item.product.stock:
                 return Response({
                     "status": "error", 
@@ -353,8 +586,7 @@ class CartViewSet(viewsets.GenericViewSet):
             item.quantity = quantity
             item.save(update_fields=['quantity', 'updated_at'])
                 
-            result_serializer = CartSerializer(cart)
-            return Response(result_serializer.data)
+            return self.cart_response(cart, item=item)
         except CartItem.DoesNotExist:
             return Response(
                 {"status": "error", "message": "آیتم در سبد خرید پیدا نشد"}, 
@@ -363,19 +595,23 @@ class CartViewSet(viewsets.GenericViewSet):
     
     @swagger_auto_schema(
         operation_summary="Remove item from cart",
-        operation_description="Remove a specific item (product with specific color/size) from the user's cart",
+        operation_description="Remove a specific item (product with specific color/size) from the user's cart, addressed by the line's id or its line_id",
         responses={200: CartSerializer()},
+        manual_parameters=[DELTA_PARAMETER],
         tags=["Cart"]
     )
     @action(detail=True, methods=['delete'], url_path='items/(?P<item_id>[^/.]+)')
     def remove_item(self, request, item_id=None, **kwargs):
+        if cart_buffer.is_enabled():
+            with cart_buffer.editing(request.user.pk) as cart:
+                return self.cached_remove_item(cart, item_id)
         cart, created = Cart.objects.get_or_create(user=request.user)
         
         try:
-            item = CartItem.objects.get(id=item_id, cart=cart)
+            item = self.get_cart_item(cart, item_id)
+            removed_item_id = item.pk
             item.delete()
-            result_serializer = CartSerializer(cart)
-            return Response(result_serializer.data)
+            return self.cart_response(cart, removed_item_id=removed_item_id, removed_line_id=self.line_id_of(item))
         except CartItem.DoesNotExist:
             return Response(
                 {"status": "error", "message": "آیتم در سبد خرید پیدا نشد"}, 
@@ -386,23 +622,129 @@ class CartViewSet(viewsets.GenericViewSet):
         operation_summary="Clear cart",
         operation_description="Remove all items from the user's cart",
         responses={200: CartSerializer()},
+        manual_parameters=[DELTA_PARAMETER],
         tags=["Cart"]
     )
     @action(detail=False, methods=['delete'], url_path='items')
     def clear_cart(self, request):
+        if cart_buffer.is_enabled():
+            with cart_buffer.editing(request.user.pk) as cart:
+                return self.cached_clear(cart)
         cart, created = Cart.objects.get_or_create(user=request.user)
         cart.items.all().delete()
-        result_serializer = CartSerializer(cart)
-        return Response(result_serializer.data)
+        return self.cart_response(cart)
+
+    @swagger_auto_schema(
+        operation_summary="Merge guest cart",
+        operation_description="Move the lines of the guest cart identified by the X-Cart-Token header into the user's cart. Login does this automatically when the header is sent.",
+        manual_parameters=[GUEST_CART_PARAMETER],
+        responses={200: CartSerializer()},
+        tags=["Cart"]
+    )
+    @action(detail=False, methods=['post'], url_path='merge')
+    @cart_buffer.settles_buffer
+    def merge_guest_cart(self, request):
+        token = request.headers.get(GUEST_CART_HEADER, '').strip()
+        cart = GuestCart.load(token).merge_into(request.user) if token else None
+        if cart is None:
+            cart, created = Cart.objects.get_or_create(user=request.user)
+        return self.cart_response(cart)
+    
+    @swagger_auto_schema(
+        operation_summary="Apply several cart changes at once",
+        operation_description="Apply a list of add / update / remove operations to the cart in one transaction and return the resulting cart. Either every operation is applied or, on the first invalid one, none is. Add takes product_id, quantity and optionally color_id / size_id; update takes item_id and quantity; remove takes item_id. An item_id is a line's id or its line_id.",
+        request_body=CartBatchSerializer,
+        responses={200: CartSerializer()},
+        tags=["Cart"]
+    )
+    @action(detail=False, methods=['post'], url_path='batch', parser_classes=[JSONParser])
+    @cart_buffer.settles_buffer
+    def batch(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        operations = serializer.validated_data['operations']
+        
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            items = {item.id: item for item in cart.items.all()}
+            original_quantities = {item_id: item.quantity for item_id, item in items.items()}
+            lines = {(item.product_id, item.selected_color_id, item.selected_size_id): item for item in items.values()}
+            by_line_id = {self.line_id_of(item): item for item in items.values()}
+            
+            product_ids = {item.product_id for item in items.values()}
+            product_ids |= {operation['product_id'] for operation in operations if operation['op'] == 'add'}
+            products = Product.objects.prefetch_related('color', 'size').in_bulk(product_ids)
+            
+            removed = set()
+            for index, operation in enumerate(operations, start=1):
+                if operation['op'] == 'add':
+                    product = products.get(operation['product_id'])
+                    if product is None:
+                        return self.batch_error(index, "محصول یافت نشد.")
+                    color_id = operation.get('color_id') or None
+                    size_id = operation.get('size_id') or None
+                    if color_id and color_id not in {color.id for color in product.color.all()}:
+                        return self.batch_error(index, "رنگ انتخاب شده برای این محصول موجود نیست.")
+                    if size_id and size_id not in {size.id for size in product.size.all()}:
+                        return self.batch_error(index, "سایز انتخاب شده برای این محصول موجود نیست.")
+                    
+                    key = (product.id, color_id, size_id)
+                    line = lines.get(key)
+                    if line is None or line.id in removed:
+                        line = CartItem(cart=cart, product_id=product.id, quantity=0, selected_color_id=color_id, selected_size_id=size_id)
+                        lines[key] = line
+                    line.quantity += operation['quantity']
+                else:
+                    item_id = operation['item_id']
+                    line = items.get(int(item_id)) if item_id.isdigit() else by_line_id.get(item_id)
+                    if line is None or line.id in removed:
+                        return self.batch_error(index, "آیتم در سبد خرید پیدا نشد")
+                    if operation['op'] == 'update':
+                        line.quantity = operation['quantity']
+                    else:
+                        removed.add(line.id)
+            
+            kept = [line for line in lines.values() if line.id not in removed]
+            wanted = {}
+            for line in kept:
+                wanted[line.product_id] = wanted.get(line.product_id, 0) + line.quantity
+            for product_id, quantity in wanted.items():
+                product = products[product_id]
+                if quantity > product.stock:
+                    return self.batch_error(None, f"موجودی کافی نیست. موجودی انبار '{product.name}': {product.stock} عدد، درخواست شده: {quantity} عدد")
+            
+            now = timezone.now()
+            new_lines = [line for line in kept if line.id is None]
+            changed = [line for line in kept if line.id is not None and line.quantity != original_quantities[line.id]]
+            for line in changed:
+                line.updated_at = now
+            if removed:
+                CartItem.objects.filter(cart=cart, id__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+            if new_lines:
+                CartItem.objects.bulk_create(new_lines)
+        
+        return self.cart_response(cart)
+    
+    def batch_error(self, index, message):
+        transaction.set_rollback(True)
+        if index is not None:
+            message = f"عملیات {index}: {message}"
+        return Response({"status": "error", "message": message}, status=status.HTTP_400_BAD_REQUEST)
 
     @swagger_auto_schema(
             operation_summary="Checkout",
             operation_description="Create an order from the cart items",
             request_body=CheckoutSerializer,
             responses={201: OrderSerializer()},
+            manual_parameters=[IDEMPOTENCY_PARAMETER],
             tags=["Cart"]
     )
     @action(detail=False, methods=['post'], url_path='checkout')
+    @idempotent
+    @cart_buffer.settles_buffer
     def checkout(self, request):
         cart, created = Cart.objects.get_or_create(user=request.user)
         serializer = CheckoutSerializer(data=request.data)
@@ -414,7 +756,7 @@ class CartViewSet(viewsets.GenericViewSet):
         payment_method = "credit card" 
         coupon_code = serializer.validated_data.get('coupon_code', '').strip()
         
-        cart_items = cart.items.all()
+        cart_items = list(cart.items.select_related('product', 'selected_color', 'selected_size'))
         if not cart_items:
             return Response(
                 {"status": "error", "message": "سبد خرید شما خالی است"}, 
@@ -428,53 +770,47 @@ class CartViewSet(viewsets.GenericViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
-        subtotal = sum(item.product.price * item.quantity for item in cart_items)
-        total = subtotal 
-        discount = Decimal('0.00')
         applied_coupon_object = None
-
-        print(f"Checkout initiated. Subtotal: {subtotal}, Coupon Code: '{coupon_code}'")
-
         if coupon_code:
-            try:
-                coupon = Coupon.objects.get(code=coupon_code, is_active=True)
-                now = timezone.now()
-                is_valid_date = coupon.valid_from <= now <= coupon.valid_to
-                is_valid_usage = not coupon.usage_limit or coupon.used_count < coupon.usage_limit
-                is_valid_min_purchase = not coupon.min_purchase or subtotal >= coupon.min_purchase
-                
-                if is_valid_date and is_valid_usage and is_valid_min_purchase:
-                    if coupon.is_percentage:
-                        discount_percentage = coupon.amount / Decimal('100.0')
-                        calculated_discount = subtotal * discount_percentage
-                    else:
-                        calculated_discount = coupon.amount
-                    
-                    if coupon.max_discount and coupon.max_discount > 0:
-                        discount = min(calculated_discount, coupon.max_discount)
-                    else:
-                        discount = calculated_discount
-                    
-                    discount = min(discount, subtotal) 
-                    total = subtotal - discount
-                    applied_coupon_object = coupon
-            except Coupon.DoesNotExist:
-                pass 
+            coupon, reason = coupon_index.check(coupon_code)
+            if reason is None:
+                applied_coupon_object = coupon
+        
+        quote = pricing.quote(
+            [(item.product.price, item.quantity) for item in cart_items], applied_coupon_object
+        )
+        discount = quote.discount
+        
+        print(f"Checkout initiated. Subtotal: {quote.subtotal}, Coupon Code: '{coupon_code}'")
+        
+        quantities = {}
+        for cart_item_obj in cart_items:
+            quantities[cart_item_obj.product_id] = quantities.get(cart_item_obj.product_id, 0) + cart_item_obj.quantity
         
         try:
             with transaction.atomic(): 
+                if not Product.objects.decrement_stock(quantities):
+                    short = Product.objects.filter(pk__in=quantities).values_list('pk', 'name', 'stock')
+                    name = next((name for pk, name, stock in short if stock < quantities[pk]), '')
+                    return Response(
+                        {"status": "error", "message": f"محصول '{name}' موجودی کافی ندارد."},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
                 order = Order.objects.create(
                     user=request.user,
                     shipping_address_id=address_id,
                     payment_method=payment_method,
-                    subtotal=subtotal,
+                    subtotal=quote.subtotal,
+                    shipping_cost=quote.shipping,
+                    tax=quote.tax,
                     discount=discount, 
-                    total=total,
+                    total=quote.total,
                     promo_code=applied_coupon_object.code if applied_coupon_object and discount > 0 else None
                 )
                 
-                for cart_item_obj in cart_items:
-                    OrderItem.objects.create(
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
                         product=cart_item_obj.product,
                         product_name=cart_item_obj.product.name,
@@ -484,16 +820,25 @@ class CartViewSet(viewsets.GenericViewSet):
                         selected_color_name=cart_item_obj.selected_color.name if cart_item_obj.selected_color else None,
                         selected_size_name=cart_item_obj.selected_size.name if cart_item_obj.selected_size else None
                     )
-                    
-                    product_to_update = cart_item_obj.product
-                    product_to_update.stock -= cart_item_obj.quantity
-                    product_to_update.save(update_fields=['stock'])
+                    for cart_item_obj in cart_items
+                ])
 
-                if applied_coupon_object and discount > 0:
-                    applied_coupon_object.used_count += 1
-                    applied_coupon_object.save(update_fields=['used_count'])
+                if applied_coupon_object and discount > 0 and not applied_coupon_object.redeem(order):
+                    transaction.set_rollback(True)
+                    coupon_index.invalidate()
+                    return Response(
+                        {"status": "error", "message": "حداکثر استفاده از این کد تخفیف به اتمام رسیده است"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
                 
                 cart.items.all().delete() 
+                
+                # The stock UPDATE skips Product signals: expire what shows stock.
+                slugs = {cart_item_obj.product.slug for cart_item_obj in cart_items}
+                transaction.on_commit(lambda: product_cache.invalidate_product(*slugs))
+                transaction.on_commit(lambda: bump_version('products'))
+                
+                order = Order.objects.select_related('shipping_address__user').prefetch_related('items').get(pk=order.pk)
                 return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response(
@@ -503,13 +848,17 @@ class CartViewSet(viewsets.GenericViewSet):
     
     @swagger_auto_schema(
         operation_summary="Decrease item quantity in cart",
-        operation_description="Decrease the quantity of a specific item (product with specific color/size) in the user's cart. If quantity becomes zero or less, the item is removed.",
+        operation_description="Decrease the quantity of a specific item (product with specific color/size) in the user's cart, addressed by the line's id or its line_id. If quantity becomes zero or less, the item is removed.",
         request_body=CartItemQuantitySerializer, 
         responses={200: CartSerializer()},
+        manual_parameters=[DELTA_PARAMETER],
         tags=["Cart"]
     )
     @action(detail=True, methods=['post'], url_path='items/(?P<item_id>[^/.]+)/decrease') 
     def decrease_item_quantity(self, request, item_id=None, **kwargs):
+        if cart_buffer.is_enabled():
+            with cart_buffer.editing(request.user.pk) as cart:
+                return self.cached_decrease_item(cart, request, item_id)
         cart, created = Cart.objects.get_or_create(user=request.user)
         serializer = CartItemQuantitySerializer(data=request.data)
 
@@ -519,22 +868,97 @@ class CartViewSet(viewsets.GenericViewSet):
         decrease_by = serializer.validated_data['quantity']
 
         try:
-            item = CartItem.objects.get(id=item_id, cart=cart)
+            item = self.get_cart_item(cart, item_id)
             
             if item.quantity > decrease_by:
                 item.quantity -= decrease_by
                 item.save()
-            else:
-                item.delete()
-                
-            result_serializer = CartSerializer(cart)
-            return Response(result_serializer.data)
+                return self.cart_response(cart, item=item)
+            
+            removed_item_id = item.pk
+            item.delete()
+            return self.cart_response(cart, removed_item_id=removed_item_id, removed_line_id=self.line_id_of(item))
         except CartItem.DoesNotExist:
             return Response(
                 {"status": "error", "message": "آیتم در سبد خرید پیدا نشد"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class GuestCartViewSet(CachedCartMixin, viewsets.GenericViewSet):
+    """
+    Cart for visitors who are not logged in, kept in the cache rather than the
+    database (see `guest_cart.py`). Logging in with the token merges it into
+    the user's cart.
+    """
+    permission_classes = [permissions.AllowAny]
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+    pagination_class = None
+    
+    def get_serializer_class(self):
+        if self.action == 'update_item':
+            return CartItemUpdateSerializer
+        return CartItemAddSerializer
+    
+    def get_guest_cart(self, create=False):
+        return GuestCart.load(self.request.headers.get(GUEST_CART_HEADER, '').strip(), create=create)
+    
+    def cached_cart_response(self, cart, **kwargs):
+        response = super().cached_cart_response(cart, **kwargs)
+        response.data = {"token": cart.token, **response.data}
+        return response
+    
+    @swagger_auto_schema(
+        operation_summary="Get guest cart",
+        operation_description="Retrieves the guest cart identified by the X-Cart-Token header",
+        manual_parameters=[GUEST_CART_PARAMETER],
+        tags=["Cart"]
+    )
+    def list(self, request):
+        return self.cached_cart_response(self.get_guest_cart())
+    
+    @swagger_auto_schema(
+        operation_summary="Add product to guest cart",
+        operation_description="Add a product to the guest cart or increase its quantity. Without an X-Cart-Token header a new guest cart is started; keep the returned token for later requests.",
+        request_body=CartItemAddSerializer,
+        manual_parameters=[GUEST_CART_PARAMETER],
+        tags=["Cart"]
+    )
+    @action(detail=False, methods=['post'], url_path='items')
+    def add_item(self, request):
+        return self.cached_add_item(self.get_guest_cart(create=True), request)
+    
+    @swagger_auto_schema(
+        operation_summary="Clear guest cart",
+        operation_description="Remove all items from the guest cart",
+        manual_parameters=[GUEST_CART_PARAMETER],
+        tags=["Cart"]
+    )
+    @add_item.mapping.delete
+    def clear_items(self, request):
+        return self.cached_clear(self.get_guest_cart())
+    
+    @swagger_auto_schema(
+        operation_summary="Update guest cart item quantity",
+        operation_description="Set the quantity of a guest cart line, identified by the id returned in the cart.",
+        request_body=CartItemUpdateSerializer,
+        manual_parameters=[GUEST_CART_PARAMETER],
+        tags=["Cart"]
+    )
+    @action(detail=False, methods=['put'], url_path='items/(?P<line_id>[^/.]+)')
+    def update_item(self, request, line_id=None):
+        return self.cached_update_item(self.get_guest_cart(), request, line_id)
+    
+    @swagger_auto_schema(
+        operation_summary="Remove item from guest cart",
+        operation_description="Remove a line from the guest cart",
+        manual_parameters=[GUEST_CART_PARAMETER],
+        tags=["Cart"]
+    )
+    @update_item.mapping.delete
+    def remove_item(self, request, line_id=None):
+        return self.cached_remove_item(self.get_guest_cart(), line_id)
+
+
 class CouponViewSet(viewsets.GenericViewSet):
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser) 
@@ -553,6 +977,22 @@ class CouponViewSet(viewsets.GenericViewSet):
             valid_to__gte=now
         )
     
+    def coupon_error(self, reason):
+        if reason == coupons.INVALID:
+            return Response(
+                {"valid": False, "message": "کد تخفیف نامعتبر است"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if reason == coupons.EXPIRED:
+            return Response(
+                {"valid": False, "message": "کد تخفیف منقضی شده است"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {"valid": False, "message": "حداکثر استفاده از این کد تخفیف به اتمام رسیده است"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     @swagger_auto_schema(
         operation_summary="Validate coupon",
         operation_description="Check if a coupon code is valid and get discount information",
@@ -567,35 +1007,13 @@ class CouponViewSet(viewsets.GenericViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
         code = serializer.validated_data['code']
-        cart_total = float(serializer.validated_data.get('cart_total', 0))
+        cart_total = serializer.validated_data.get('cart_total', 0)
         
-        try:
-            coupon = Coupon.objects.get(code=code, is_active=True)
-        except Coupon.DoesNotExist:
-            return Response(
-                {"valid": False, "message": "کد تخفیف نامعتبر است"}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+        coupon, reason = coupon_index.check(code)
+        if reason is not None:
+            return self.coupon_error(reason)
             
-        now = timezone.now()
-        if not (coupon.valid_from <= now <= coupon.valid_to):
-            return Response(
-                {"valid": False, "message": "کد تخفیف منقضی شده است"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
-        if coupon.usage_limit and coupon.used_count >= coupon.usage_limit:
-            return Response(
-                {"valid": False, "message": "حداکثر استفاده از این کد تخفیف به اتمام رسیده است"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
-        discount_amount = 0
-        if cart_total > 0:
-            if coupon.is_percentage:
-                discount_amount = cart_total * (coupon.amount / 100)
-            else:
-                discount_amount = min(coupon.amount, cart_total)
+        quote = pricing.quote([(cart_total, 1)], coupon)
         
         response_data = {
             "valid": True,
@@ -604,8 +1022,8 @@ class CouponViewSet(viewsets.GenericViewSet):
         
         if cart_total > 0:
             response_data.update({
-                "discount_amount": int(discount_amount),
-                "total_after_discount": int(cart_total - discount_amount)
+                "discount_amount": int(quote.discount),
+                "total_after_discount": int(quote.subtotal - quote.discount)
             })
             
         return Response(response_data)
@@ -617,6 +1035,7 @@ class CouponViewSet(viewsets.GenericViewSet):
         tags=["Coupons"]
     )
     @action(detail=False, methods=['post'], url_path='apply')
+    @cart_buffer.settles_buffer
     def apply_to_cart(self, request):
         serializer = CouponValidateSerializer(data=request.data)
         
@@ -633,40 +1052,22 @@ class CouponViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        try:
-            coupon = Coupon.objects.get(code=code, is_active=True)
-        except Coupon.DoesNotExist:
-            return Response(
-                {"valid": False, "message": "کد تخفیف نامعتبر است"}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-            
-        now = timezone.now()
-        if not (coupon.valid_from <= now <= coupon.valid_to):
-            return Response(
-                {"valid": False, "message": "کد تخفیف منقضی شده است"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
-        if coupon.usage_limit and coupon.used_count >= coupon.usage_limit:
-            return Response(
-                {"valid": False, "message": "حداکثر استفاده از این کد تخفیف به اتمام رسیده است"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        coupon, reason = coupon_index.check(code)
+        if reason is not None:
+            return self.coupon_error(reason)
         
-        items = cart.items.all()
-        cart_total = sum(item.product.price * item.quantity for item in items)
-        if coupon.is_percentage:
-            discount_amount = cart_total * (coupon.amount / 100)
-        else: 
-            discount_amount = min(coupon.amount, cart_total)
+        lines = cart.items.values_list('product__price', 'quantity')
+        quote = pricing.quote(lines, coupon)
         
         return Response({
             "valid": True,
             "coupon": CouponSerializer(coupon).data,
-            "cart_total": int(cart_total),
-            "discount_amount": int(discount_amount),
-            "total_after_discount": int(cart_total - discount_amount)
+            "cart_total": int(quote.subtotal),
+            "discount_amount": int(quote.discount),
+            "total_after_discount": int(quote.subtotal - quote.discount),
+            "shipping_cost": int(quote.shipping),
+            "tax": int(quote.tax),
+            "total": int(quote.total)
         })
 
 
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db import transaction
 from .models import *
 from django.contrib.auth.models import Group
 
@@ -6,6 +7,7 @@ from django.contrib.auth.models import Group
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1  
+    readonly_fields = ('width', 'height', 'content_hash')
 
 
 class SpecificationInline(admin.TabularInline):
@@ -51,7 +53,8 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_at')
+    list_display = ('name', 'parent', 'product_count', 'subtree_product_count', 'created_at')
+    ordering = ('path',)
     search_fields = ('name',)
     prepopulated_fields = {'slug': ('name',)}
 
@@ -63,5 +66,23 @@ class ReviewAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'user__email', 'title', 'comment')
     list_editable = ('is_approved',)
 
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            before = Review.locked_snapshot(obj.pk) if change else None
+            super().save_model(request, obj, form, change)
+            ProductRatingSummary.record(before=before, after=obj.rating_snapshot())
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            before = Review.locked_snapshot(obj.pk)
+            super().delete_model(request, obj)
+            ProductRatingSummary.record(before=before)
+
+    def delete_queryset(self, request, queryset):
+        product_ids = set(queryset.values_list('product_id', flat=True))
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            ProductRatingSummary.rebuild(product_ids=product_ids)
+
 
 admin.site.unregister(Group)
\ No newline at end of file
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ProductsConfig(AppConfig):
+    name = 'apps.products'
+    label = 'products'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,32 @@
+"""
+Cached nested category tree.
+
+The whole tree is built from one query ordered by materialized path and kept
+in the cache until a category changes or a product moves in or out of one.
+"""
+from django.core.cache import cache
+
+from .models import Category
+
+TREE_CACHE_KEY = 'products:category-tree'
+
+
+def build_category_tree():
+    nodes = {}
+    roots = []
+    fields = ('id', 'name', 'slug', 'parent_id', 'depth', 'product_count', 'subtree_product_count')
+    for row in Category.objects.order_by('path').values(*fields):
+        parent_id = row.pop('parent_id')
+        node = dict(row, children=[])
+        nodes[node['id']] = node
+        parent = nodes.get(parent_id)
+        (parent['children'] if parent else roots).append(node)
+    return roots
+
+
+def get_category_tree():
+    return cache.get_or_set(TREE_CACHE_KEY, build_category_tree, None)
+
+
+def invalidate_category_tree():
+    cache.delete(TREE_CACHE_KEY)
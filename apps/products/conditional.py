@@ -0,0 +1,104 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the catalog endpoints.
+
+Each catalog "table" has a version number and a last-modified timestamp in
+the cache, bumped by the signal handlers in `signals.py` whenever something
+that shows up in its payloads changes. Validators are built from those
+values alone, so a matching If-None-Match / If-Modified-Since request gets a
+304 before any query or serializer runs.
+
+Versions live in the configured cache, which should be shared by all
+processes (see CACHES in settings). They also expire after
+`CATALOG_VERSION_TIMEOUT` seconds and restart at a fresh, never reused
+value, so even with a per-process cache a change made in another process
+is picked up within that time instead of never.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+
+def _version_key(table):
+    return f'catalog:version:{table}'
+
+
+def _modified_key(table):
+    return f'catalog:modified:{table}'
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_VERSION_TIMEOUT', 5 * 60)
+
+
+def _new_version():
+    # Unique per bump, so a version that expired and restarted never matches
+    # an ETag issued before.
+    return time.time_ns()
+
+
+def bump_version(*tables):
+    now = int(time.time())
+    for table in tables:
+        cache.set(_version_key(table), _new_version(), _timeout())
+        cache.set(_modified_key(table), now, _timeout())
+
+
+def get_versions(tables):
+    """
+    Return ({table: version}, last modified timestamp) for the given tables.
+    Tables seen for the first time (or whose version expired) start at a
+    fresh version, modified now.
+    """
+    keys = [_version_key(table) for table in tables] + [_modified_key(table) for table in tables]
+    values = cache.get_many(keys)
+    missing = [table for table in tables if _version_key(table) not in values]
+    if missing:
+        now = int(time.time())
+        for table in missing:
+            cache.add(_version_key(table), _new_version(), _timeout())
+            cache.add(_modified_key(table), now, _timeout())
+        values = cache.get_many(keys)
+
+    versions = {table: values.get(_version_key(table), 1) for table in tables}
+    modified = [values[_modified_key(table)] for table in tables if _modified_key(table) in values]
+    return versions, max(modified) if modified else None
+
+
+def conditional_get(view_method):
+    """
+    Decorate a viewset `list`/`retrieve` so it honours If-None-Match and
+    If-Modified-Since. The viewset lists what its payload depends on in
+    `conditional_tables`; `conditional_per_user = True` also mixes the user's
+    wishlist version into the ETag for payloads carrying per-user fields.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        tables = list(self.conditional_tables)
+        per_user = getattr(self, 'conditional_per_user', False) and request.user.is_authenticated
+        if per_user:
+            tables.append(f'wishlist:{request.user.pk}')
+        versions, last_modified = get_versions(tables)
+
+        parts = [f'{table}={version}' for table, version in sorted(versions.items())]
+        parts += [request.get_full_path(), getattr(request, 'accepted_media_type', '')]
+        if per_user:
+            parts.append(f'user={request.user.pk}')
+        etag = quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    return wrapper
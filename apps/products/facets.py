@@ -0,0 +1,236 @@
+"""
+In-memory inverted index for faceted catalog filtering.
+
+Each facet value (a category, brand, gender, size or color slug) maps to a
+bitset of the active product ids carrying it, stored as a Python int. Filters
+are AND-ed across facets and OR-ed within one facet, and facet counts are
+popcounts of bitset intersections, so a filter-plus-counts request never
+touches the database except to load the page of products it returns.
+
+The index is built lazily per process and patched in place by the signal
+handlers in `signals.py`. Every change also bumps a version number in the
+cache, so other processes sharing that cache rebuild on their next read.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+FACETS = ('category', 'brand', 'gender', 'size', 'color')
+
+VERSION_CACHE_KEY = 'products:facet-index:version'
+
+
+def bitset_from_ids(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        buffer[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def ids_from_bitset(bits, limit=None, offset=0):
+    """
+    Product ids in a bitset, highest (newest) first.
+    """
+    ids = []
+    skipped = 0
+    while bits and (limit is None or len(ids) < limit):
+        product_id = bits.bit_length() - 1
+        bits ^= 1 << product_id
+        if skipped < offset:
+            skipped += 1
+            continue
+        ids.append(product_id)
+    return ids
+
+
+class FacetIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built_at = None
+        self.all = 0
+        self.values = {facet: {} for facet in FACETS}
+        self.products = {}
+        self.prices = []
+
+    def build(self):
+        version = cache.get_or_set(VERSION_CACHE_KEY, 1, None)
+        products = {}
+        rows = Product.objects.filter(is_active=True).values_list(
+            'id', 'price', 'category__slug', 'brand__slug', 'gender__slug'
+        )
+        for product_id, price, category, brand, gender in rows.iterator(chunk_size=2000):
+            products[product_id] = {
+                'price': price,
+                'category': {category}, 'brand': {brand}, 'gender': {gender},
+                'size': set(), 'color': set(),
+            }
+        for facet in ('size', 'color'):
+            through = Product._meta.get_field(facet).remote_field.through
+            pairs = through.objects.filter(product__is_active=True).values_list('product_id', f'{facet}__slug')
+            for product_id, slug in pairs.iterator(chunk_size=2000):
+                if product_id in products:
+                    products[product_id][facet].add(slug)
+
+        postings = {facet: {} for facet in FACETS}
+        for product_id, entry in products.items():
+            for facet in FACETS:
+                for slug in entry[facet]:
+                    postings[facet].setdefault(slug, []).append(product_id)
+
+        with self.lock:
+            self.products = products
+            self.all = bitset_from_ids(products)
+            self.values = {
+                facet: {slug: bitset_from_ids(ids) for slug, ids in by_value.items()}
+                for facet, by_value in postings.items()
+            }
+            self.prices = sorted((entry['price'], product_id) for product_id, entry in products.items())
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self):
+        max_age = getattr(settings, 'PRODUCT_FACET_INDEX_MAX_AGE', 300)
+        stale = (
+            self.version is None
+            or self.version != cache.get(VERSION_CACHE_KEY)
+            or time.monotonic() - self.built_at > max_age
+        )
+        if stale:
+            with self.lock:
+                self.build()
+
+    def _remove(self, product_id):
+        entry = self.products.pop(product_id, None)
+        if entry is None:
+            return
+        mask = ~(1 << product_id)
+        self.all &= mask
+        for facet in FACETS:
+            for slug in entry[facet]:
+                self.values[facet][slug] &= mask
+        position = bisect_left(self.prices, (entry['price'], product_id))
+        if position < len(self.prices) and self.prices[position] == (entry['price'], product_id):
+            del self.prices[position]
+
+    def _add(self, product_id, entry):
+        self.products[product_id] = entry
+        bit = 1 << product_id
+        self.all |= bit
+        for facet in FACETS:
+            for slug in entry[facet]:
+                self.values[facet][slug] = self.values[facet].get(slug, 0) | bit
+        insort(self.prices, (entry['price'], product_id))
+
+    def patch(self, product_id):
+        """
+        Re-read one product and update its bits. Called after product saves,
+        deletes and size/color changes have committed.
+        """
+        new_version = self._bump_version()
+        with self.lock:
+            # Checked under the lock: invalidate() may have reset it meanwhile.
+            if self.version is None:
+                return
+            if new_version != self.version + 1:
+                # Another process changed the catalog too; rebuild on next read.
+                self.version = None
+                return
+            self._remove(product_id)
+            product = (
+                Product.objects.filter(pk=product_id, is_active=True)
+                .select_related('category', 'brand', 'gender')
+                .prefetch_related('size', 'color')
+                .first()
+            )
+            if product is not None:
+                self._add(product_id, {
+                    'price': product.price,
+                    'category': {product.category.slug},
+                    'brand': {product.brand.slug},
+                    'gender': {product.gender.slug},
+                    'size': {size.slug for size in product.size.all()},
+                    'color': {color.slug for color in product.color.all()},
+                })
+            self.version = new_version
+
+    def invalidate(self):
+        """
+        Mark the index stale everywhere, e.g. after a facet value was renamed
+        or a bulk import bypassed the model signals.
+        """
+        self._bump_version()
+        self.version = None
+
+    def _bump_version(self):
+        try:
+            return cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, None)
+            return 1
+
+    def price_bits(self, min_price=None, max_price=None):
+        low = 0 if min_price is None else bisect_left(self.prices, (min_price, -1))
+        high = len(self.prices) if max_price is None else bisect_right(self.prices, (max_price, float('inf')))
+        return bitset_from_ids(product_id for _, product_id in self.prices[low:high])
+
+    def query(self, selections, min_price=None, max_price=None, limit=24, offset=0):
+        """
+        Apply facet selections ({facet: [slugs]}) and a price range.
+
+        Returns (matching count, page of product ids, facet counts, price range).
+        Counts for a facet ignore that facet's own selection, so shoppers can
+        see how many products each alternative value would give them.
+        """
+        self.ensure_fresh()
+        with self.lock:
+            masks = {}
+            for facet, slugs in selections.items():
+                if facet in FACETS and slugs:
+                    mask = 0
+                    for slug in slugs:
+                        mask |= self.values[facet].get(slug, 0)
+                    masks[facet] = mask
+            if min_price is not None or max_price is not None:
+                masks['price'] = self.price_bits(min_price, max_price)
+
+            matched = self.all
+            for mask in masks.values():
+                matched &= mask
+
+            facet_counts = {}
+            for facet in FACETS:
+                base = self.all
+                for other, mask in masks.items():
+                    if other != facet:
+                        base &= mask
+                counts = {slug: (bits & base).bit_count() for slug, bits in self.values[facet].items()}
+                facet_counts[facet] = {slug: count for slug, count in counts.items() if count}
+
+            price_range = None
+            if self.prices:
+                price_range = {'min': self.prices[0][0], 'max': self.prices[-1][0]}
+
+            return matched.bit_count(), ids_from_bitset(matched, limit, offset), facet_counts, price_range
+
+
+facet_index = FacetIndex()
+
+
+def parse_price(value):
+    if value in (None, ''):
+        return None
+    price = Decimal(value)
+    if not price.is_finite():
+        # NaN would only fail later, when bisect compares it.
+        raise ValueError(f"Invalid price: {value}")
+    return price
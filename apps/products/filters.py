@@ -0,0 +1,31 @@
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import Category
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    Ordering filter that always ends with `-id`, so ties (same price, same
+    rating) keep a stable order across cursor pages.
+    """
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('-id')
+        return tuple(ordering)
+
+
+class ProductCategoryFilter(BaseFilterBackend):
+    """
+    `?category=<slug>` keeps products of that category; with `descendants=1`
+    its whole subtree is included through an index range on the category path.
+    """
+    def filter_queryset(self, request, queryset, view):
+        slug = request.query_params.get('category')
+        if not slug:
+            return queryset
+        category = Category.objects.filter(slug=slug).only('id', 'path').first()
+        if category is None:
+            return queryset.none()
+        descendants = request.query_params.get('descendants') in ('1', 'true', 'True')
+        return queryset.in_category(category, descendants=descendants)
@@ -0,0 +1,179 @@
+"""
+Background generation of resized ProductImage variants.
+
+Saving a ProductImage with a new file schedules it here after the transaction
+commits. A small thread pool does the I/O and database work and hands the
+CPU-bound Pillow encoding (`imaging.render_variants`) to a process pool, so
+requests only pay for enqueueing. Originals are identified by a SHA-256
+content hash: an upload whose bytes were already processed reuses the
+existing variant files instead of being re-encoded.
+
+`PRODUCT_IMAGE_VARIANTS` picks what is generated, e.g.
+{'widths': [400, 800], 'formats': ['webp']}; a missing key keeps the default
+of `imaging.VARIANT_WIDTHS` / all of `imaging.VARIANT_FORMATS`.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+
+from . import product_cache
+from .conditional import bump_version
+from .imaging import VARIANT_FORMATS, VARIANT_WIDTHS, render_variants
+from .models import ProductImage, ProductImageVariant
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_process_pool = None
+_thread_pool = None
+
+
+def _pools():
+    global _process_pool, _thread_pool
+    with _lock:
+        if _process_pool is None:
+            workers = getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2)
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _thread_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='product-images')
+    return _process_pool, _thread_pool
+
+
+def variant_spec():
+    """
+    (widths, formats) to generate, from PRODUCT_IMAGE_VARIANTS.
+    """
+    spec = getattr(settings, 'PRODUCT_IMAGE_VARIANTS', {})
+    widths = tuple(int(width) for width in spec.get('widths', VARIANT_WIDTHS))
+    formats = tuple(spec.get('formats', VARIANT_FORMATS))
+    unknown = set(formats) - set(VARIANT_FORMATS)
+    if unknown or not widths or not formats:
+        raise ImproperlyConfigured(
+            f"PRODUCT_IMAGE_VARIANTS needs widths and formats out of {', '.join(VARIANT_FORMATS)}"
+        )
+    return widths, formats
+
+
+def schedule_variants(image_id):
+    """
+    Generate variants for an image once the current transaction commits.
+    Runs inline when PRODUCT_IMAGE_VARIANTS_ASYNC is False.
+    """
+    if not getattr(settings, 'PRODUCT_IMAGE_VARIANTS_ASYNC', True):
+        transaction.on_commit(lambda: process_image(image_id))
+        return
+    transaction.on_commit(lambda: _pools()[1].submit(_process_in_background, image_id))
+
+
+def _process_in_background(image_id):
+    close_old_connections()
+    try:
+        process_image(image_id, render=lambda *args: _pools()[0].submit(render_variants, *args).result())
+    except Exception:
+        logger.exception("Could not generate variants for product image %s", image_id)
+    finally:
+        connection.close()
+
+
+def _variant_name(content_hash, variant):
+    extension = 'jpg' if variant['format'] == 'jpeg' else variant['format']
+    return f"products/variants/{content_hash[:2]}/{content_hash}_{variant['width']}.{extension}"
+
+
+def _store_variant(name, content, force):
+    """
+    Write a variant file under its content-addressed name. The same name is
+    shared by every twin, so an existing file is never removed first: it is
+    kept when the bytes match and otherwise replaced in one rename.
+    """
+    if default_storage.exists(name):
+        if not force:
+            return
+        with default_storage.open(name, 'rb') as existing:
+            if existing.read() == content:
+                return
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            # No local path to rename over; storages like S3 replace an
+            # object in a single upload anyway.
+            default_storage.delete(name)
+        else:
+            temporary = default_storage.save(f'{name}.tmp', ContentFile(content))
+            os.replace(default_storage.path(temporary), path)
+            return
+    saved = default_storage.save(name, ContentFile(content))
+    if saved != name:
+        # A twin wrote the same file meanwhile; the copy is redundant.
+        default_storage.delete(saved)
+
+
+def _delete_unused(names):
+    """
+    Remove variant files no variant row points to any more.
+    """
+    used = set(ProductImageVariant.objects.filter(file__in=names).values_list('file', flat=True))
+    for name in set(names) - used:
+        default_storage.delete(name)
+
+
+def process_image(image_id, render=render_variants, force=False):
+    """
+    Hash the original, then either copy the variants of an identical upload
+    or encode new ones. Returns True when the image was re-encoded.
+
+    `force` always re-encodes and replaces variant files whose bytes changed,
+    e.g. after PRODUCT_IMAGE_VARIANTS changed. Files left without a variant
+    row are deleted.
+    """
+    image = ProductImage.objects.filter(pk=image_id).select_related('product').first()
+    if image is None or not image.image:
+        return False
+
+    with image.image.open('rb') as original:
+        data = original.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    twin = None
+    if not force:
+        twin = (
+            ProductImage.objects.filter(content_hash=content_hash, variants__isnull=False)
+            .exclude(pk=image.pk).distinct().first()
+        )
+    if twin is not None:
+        variants = [
+            ProductImageVariant(image=image, file=variant.file.name, format=variant.format,
+                                width=variant.width, height=variant.height)
+            for variant in twin.variants.all()
+        ]
+        width, height, encoded = twin.width, twin.height, False
+    else:
+        width, height, rendered = render(data, *variant_spec())
+        variants = []
+        for variant in rendered:
+            name = _variant_name(content_hash, variant)
+            _store_variant(name, variant['content'], force)
+            variants.append(ProductImageVariant(image=image, file=name, format=variant['format'],
+                                                width=variant['width'], height=variant['height']))
+        encoded = True
+
+    with transaction.atomic():
+        # update() rather than save() so the post_save handler does not reschedule.
+        ProductImage.objects.filter(pk=image.pk).update(content_hash=content_hash, width=width, height=height)
+        previous = list(image.variants.values_list('file', flat=True))
+        image.variants.all().delete()
+        ProductImageVariant.objects.bulk_create(variants)
+    _delete_unused(set(previous) - {variant.file.name for variant in variants})
+
+    product_cache.invalidate_product(image.product.slug)
+    bump_version('products')
+    return encoded
+
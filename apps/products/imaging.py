@@ -0,0 +1,49 @@
+"""
+Pillow encoding for product image variants.
+
+Kept free of Django imports so it can run in worker processes of the image
+pipeline's process pool (see `image_pipeline.py`).
+"""
+import io
+
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (200, 400, 800, 1200)
+
+# format name -> (Pillow format, encoder options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def render_variants(data, widths=VARIANT_WIDTHS, formats=tuple(VARIANT_FORMATS)):
+    """
+    Resize an encoded image to each width (never upscaling) in each format.
+
+    Returns (original width, original height, [variant dicts]) where every
+    variant has width, height, format and the encoded bytes as content.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    original_width, original_height = image.size
+    targets = [width for width in widths if width < original_width] or [original_width]
+
+    variants = []
+    for width in targets:
+        height = max(1, round(original_height * width / original_width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != original_width else image
+        for name in formats:
+            pillow_format, options = VARIANT_FORMATS[name]
+            frame = resized
+            if pillow_format == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                frame = frame.convert('RGB')
+            elif frame.mode not in ('RGB', 'RGBA', 'L'):
+                frame = frame.convert('RGBA')
+            buffer = io.BytesIO()
+            frame.save(buffer, pillow_format, **options)
+            variants.append({'width': width, 'height': height, 'format': name, 'content': buffer.getvalue()})
+
+    return original_width, original_height, variants
@@ -0,0 +1,53 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.products.image_pipeline import process_image
+from apps.products.imaging import render_variants
+from apps.products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants for product images that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-encode variants for every image, e.g. after changing PRODUCT_IMAGE_VARIANTS')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Encoding processes')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('pk')
+        if not options['all']:
+            images = images.filter(content_hash='')
+        image_ids = list(images.values_list('pk', flat=True))
+        workers = max(1, options['workers'])
+
+        encoded = reused = failed = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool, \
+                ThreadPoolExecutor(max_workers=workers) as threads:
+
+            def run(image_id):
+                try:
+                    return process_image(
+                        image_id,
+                        render=lambda *args: pool.submit(render_variants, *args).result(),
+                        force=options['all'],
+                    )
+                except Exception as exc:
+                    self.stderr.write(f"Image {image_id}: {exc}")
+                    return None
+                finally:
+                    connection.close()
+
+            for result in threads.map(run, image_ids):
+                if result is None:
+                    failed += 1
+                elif result:
+                    encoded += 1
+                else:
+                    reused += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(image_ids)} images: {encoded} encoded, {reused} reused, {failed} failed."
+        ))
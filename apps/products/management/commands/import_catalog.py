@@ -0,0 +1,250 @@
+import csv
+import json
+import sys
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
+
+from apps.products import search
+from apps.products.category_tree import invalidate_category_tree
+from apps.products.conditional import bump_version
+from apps.products.facets import facet_index
+from apps.products.models import Brand, Category, Color, Gender, Product, Size, Specification
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV or JSONL feed into the catalog with bulk inserts. "
+        "Each record has name, description, price, and category/brand/gender slugs, "
+        "optionally slug, stock, is_active, sizes, colors and specifications. In CSV, "
+        "sizes/colors are '|' separated slugs and specifications are 'name:value|name:value'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products inserted per transaction')
+        parser.add_argument(
+            '--create-missing', action='store_true',
+            help='Create categories, brands, genders, sizes and colors that do not exist yet'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.batch_size = options['batch_size']
+        self.create_missing = options['create_missing']
+
+        self.lookups = {
+            model: dict(model.objects.values_list('slug', 'id'))
+            for model in (Category, Brand, Gender, Size, Color)
+        }
+        self.taken_slugs = set(Product.objects.values_list('slug', flat=True).iterator(chunk_size=5000))
+        self.slug_counters = {}
+        self.imported = 0
+        self.skipped = 0
+
+        stream = sys.stdin if path == '-' else self._open(path)
+        try:
+            records = self._read_csv(stream) if feed_format == 'csv' else self._read_jsonl(stream)
+            batch = []
+            for line_number, record in records:
+                try:
+                    batch.append(self._build(record))
+                except KeyError as exc:
+                    self.skipped += 1
+                    self.stderr.write(f"Line {line_number}: skipped (missing field {exc})")
+                    continue
+                except ValueError as exc:
+                    self.skipped += 1
+                    self.stderr.write(f"Line {line_number}: skipped ({exc})")
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self._refresh_derived_data()
+        self.stdout.write(self.style.SUCCESS(f"Imported {self.imported} products, skipped {self.skipped}."))
+
+    def _open(self, path):
+        try:
+            return open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(f"Cannot open {path}: {exc}")
+
+    def _read_csv(self, stream):
+        for line_number, row in enumerate(csv.DictReader(stream), start=2):
+            row['sizes'] = [value for value in (row.get('sizes') or '').split('|') if value]
+            row['colors'] = [value for value in (row.get('colors') or '').split('|') if value]
+            specifications = []
+            for pair in (row.get('specifications') or '').split('|'):
+                if ':' in pair:
+                    name, value = pair.split(':', 1)
+                    specifications.append({'name': name.strip(), 'value': value.strip()})
+            row['specifications'] = specifications
+            yield line_number, row
+
+    def _read_jsonl(self, stream):
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                self.skipped += 1
+                self.stderr.write(f"Line {line_number}: skipped (invalid JSON: {exc})")
+                continue
+            specifications = record.get('specifications') or []
+            if isinstance(specifications, dict):
+                specifications = [{'name': name, 'value': value} for name, value in specifications.items()]
+            record['specifications'] = specifications
+            yield line_number, record
+
+    def _resolve(self, model, value):
+        slug = slugify(str(value))
+        if slug in self.lookups[model]:
+            return self.lookups[model][slug]
+        if not self.create_missing:
+            raise ValueError(f"unknown {model.__name__.lower()} '{value}'")
+        if model is Color:
+            instance = Color.objects.create(name=str(value), slug=slug, color_code='')
+        else:
+            instance = model.objects.create(name=str(value), slug=slug)
+        self.lookups[model][instance.slug] = instance.id
+        self.lookups[model][slug] = instance.id
+        return instance.id
+
+    def _free_slug(self, base):
+        """
+        Same scheme as Product.save() ("name", "name-1", ...), resolved against
+        the in-memory slug set instead of one query per attempt. The base is
+        cut short where needed so the slug, suffix included, fits the field.
+        """
+        max_length = Product._meta.get_field('slug').max_length
+        base = base[:max_length].rstrip('-') or 'product'
+        slug = base
+        counter = self.slug_counters.get(base, 1)
+        while slug in self.taken_slugs:
+            suffix = f"-{counter}"
+            slug = f"{base[:max_length - len(suffix)].rstrip('-')}{suffix}"
+            counter += 1
+        self.slug_counters[base] = counter
+        self.taken_slugs.add(slug)
+        return slug
+
+    def _build(self, record):
+        name = str(record['name']).strip()
+        if not name:
+            raise ValueError("empty name")
+        max_length = Product._meta.get_field('name').max_length
+        if len(name) > max_length:
+            raise ValueError(f"name longer than {max_length} characters")
+        price = self._price(record['price'])
+        try:
+            stock = int(record.get('stock') or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid stock '{record.get('stock')}'")
+        if stock < 0:
+            raise ValueError(f"negative stock '{stock}'")
+        if not isinstance(record['specifications'], list):
+            raise ValueError(f"invalid specifications {record['specifications']!r}")
+        specifications = []
+        for spec in record['specifications']:
+            if not isinstance(spec, dict) or 'name' not in spec or 'value' not in spec:
+                raise ValueError(f"invalid specification {spec!r}")
+            specifications.append((str(spec['name'])[:100], str(spec['value'])[:200]))
+        is_active = record.get('is_active', True)
+        if isinstance(is_active, str):
+            is_active = is_active.strip().lower() not in ('0', 'false', 'no', '')
+        product = Product(
+            name=name,
+            description=record.get('description') or '',
+            price=price,
+            stock=stock,
+            is_active=bool(is_active),
+            category_id=self._resolve(Category, record['category']),
+            brand_id=self._resolve(Brand, record['brand']),
+            gender_id=self._resolve(Gender, record['gender']),
+        )
+        sizes = [self._resolve(Size, value) for value in record.get('sizes') or []]
+        colors = [self._resolve(Color, value) for value in record.get('colors') or []]
+        # Last, so a skipped row doesn't hold on to a slug.
+        product.slug = self._free_slug(slugify(record.get('slug') or name) or 'product')
+        return product, sizes, colors, specifications
+
+    def _price(self, value):
+        """
+        The price as a Decimal that fits Product.price, or ValueError: bad
+        values would otherwise only fail at insert time, taking the whole
+        chunk with them.
+        """
+        field = Product._meta.get_field('price')
+        try:
+            price = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError(f"invalid price '{value}'")
+        if not price.is_finite() or price < 0:
+            raise ValueError(f"invalid price '{value}'")
+        too_long = ValueError(f"price '{value}' has more than {field.max_digits} digits")
+        if price.adjusted() + 1 > field.max_digits - field.decimal_places:
+            raise too_long
+        try:
+            price = price.quantize(Decimal(1).scaleb(-field.decimal_places))
+        except InvalidOperation:
+            raise too_long
+        if len(price.as_tuple().digits) > field.max_digits:
+            raise too_long
+        return price
+
+    def _flush(self, batch):
+        products = [product for product, _, _, _ in batch]
+        with transaction.atomic():
+            Product.objects.bulk_create(products, batch_size=self.batch_size)
+            if any(product.pk is None for product in products):
+                # Backends without RETURNING (MySQL): look the new ids up by slug.
+                ids = dict(Product.objects.filter(slug__in=[p.slug for p in products]).values_list('slug', 'id'))
+                for product in products:
+                    product.pk = ids[product.slug]
+
+            SizeThrough = Product.size.through
+            ColorThrough = Product.color.through
+            SizeThrough.objects.bulk_create(
+                [SizeThrough(product_id=product.pk, size_id=size_id)
+                 for product, sizes, _, _ in batch for size_id in set(sizes)],
+                batch_size=self.batch_size,
+            )
+            ColorThrough.objects.bulk_create(
+                [ColorThrough(product_id=product.pk, color_id=color_id)
+                 for product, _, colors, _ in batch for color_id in set(colors)],
+                batch_size=self.batch_size,
+            )
+            Specification.objects.bulk_create(
+                [Specification(product_id=product.pk, name=name, value=value)
+                 for product, _, _, specifications in batch for name, value in specifications],
+                batch_size=self.batch_size,
+            )
+
+            # bulk_create skips the model signals; keep derived data in step.
+            search.index_products([product.pk for product in products])
+            per_category = {}
+            for product in products:
+                if product.is_active:
+                    per_category[product.category_id] = per_category.get(product.category_id, 0) + 1
+            for category_id, count in per_category.items():
+                Category.adjust_product_count(category_id, count)
+
+        self.imported += len(products)
+        self.stdout.write(f"Imported {self.imported} products...")
+
+    def _refresh_derived_data(self):
+        facet_index.invalidate()
+        invalidate_category_tree()
+        bump_version('products', 'categories', 'brands')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.products.category_tree import invalidate_category_tree
+from apps.products.models import Category
+
+
+class Command(BaseCommand):
+    help = "Recompute category paths, depths and product counts"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = Category.rebuild_tree()
+        invalidate_category_tree()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} categories."))
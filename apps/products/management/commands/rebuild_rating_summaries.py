@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.products.models import ProductRatingSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild every product's rating summary from its approved reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products written per bulk upsert')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = ProductRatingSummary.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rating summaries."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.products import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING("Full-text search needs the SQLite database backend; nothing to do."))
+            return
+        with transaction.atomic():
+            indexed = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_summaries(apps, schema_editor):
+    Review = apps.get_model('products', 'Review')
+    ProductRatingSummary = apps.get_model('products', 'ProductRatingSummary')
+
+    histogram = {f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)}
+    rows = (
+        Review.objects.filter(is_approved=True)
+        .order_by()
+        .values('product_id')
+        .annotate(review_count=Count('id'), rating_sum=Sum('rating'), **histogram)
+    )
+    ProductRatingSummary.objects.bulk_create(
+        [
+            ProductRatingSummary(average=row['rating_sum'] / row['review_count'], **row)
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_remove_product_specification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(db_index=True, default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_summary', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Product rating summaries',
+            },
+        ),
+        migrations.RunPython(backfill_rating_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5("
+        "name, description, brand, category, specifications, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO products_product_fts (rowid, name, description, brand, category, specifications) "
+        "SELECT p.id, p.name, p.description, b.name, c.name, "
+        "(SELECT group_concat(s.name || ' ' || s.value, ' ') "
+        "FROM products_specification s WHERE s.product_id = p.id) "
+        "FROM products_product p "
+        "JOIN products_brand b ON b.id = p.brand_id "
+        "JOIN products_category c ON c.id = p.category_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_productratingsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
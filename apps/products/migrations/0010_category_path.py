@@ -0,0 +1,62 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_category_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+
+    categories = {category.pk: category for category in Category.objects.all()}
+    direct = dict(
+        Product.objects.filter(is_active=True).order_by()
+        .values('category_id').annotate(total=Count('id')).values_list('category_id', 'total')
+    )
+
+    def resolve(category):
+        parent = categories.get(category.parent_id)
+        return f"{resolve(parent) if parent else ''}{category.pk}/"
+
+    for category in categories.values():
+        category.path = resolve(category)
+        category.depth = category.path.count('/') - 1
+        category.product_count = direct.get(category.pk, 0)
+    for category in categories.values():
+        for ancestor_id in (int(part) for part in category.path.split('/') if part):
+            categories[ancestor_id].subtree_product_count += category.product_count
+
+    Category.objects.bulk_update(
+        categories.values(), ['path', 'depth', 'product_count', 'subtree_product_count'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='subtree_product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(build_category_paths, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, Concat, Substr
 from django.utils.text import slugify
 
 class Category(models.Model):
@@ -8,9 +11,42 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Materialized path of ancestor ids, root first, e.g. "1/7/12/". A subtree
+    # is the index range [path, subtree_upper_bound(path)).
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Active products directly in this category / in it and all descendants.
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    subtree_product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Written only through queryset updates, never from a (possibly stale) instance.
+    MAINTAINED_FIELDS = ('path', 'depth', 'product_count', 'subtree_product_count')
+
     class Meta:
         verbose_name_plural = 'Categories'
 
+    @staticmethod
+    def subtree_upper_bound(path):
+        # "/" is followed by "0" in ASCII, so this is the first string after
+        # every path that starts with `path`.
+        return path[:-1] + '0'
+
+    @classmethod
+    def subtree_filter(cls, path, prefix=''):
+        return Q(**{f'{prefix}path__gte': path, f'{prefix}path__lt': cls.subtree_upper_bound(path)})
+
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to and including this category."""
+        return [int(part) for part in self.path.split('/') if part]
+
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            if self.path and parent_path.startswith(self.path):
+                raise ValidationError({'parent': "A category cannot be moved under itself or one of its subcategories."})
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -20,7 +56,92 @@ class Category(models.Model):
         while Category.objects.filter(slug=self.slug).exclude(id=self.id).exists():
             self.slug = f"{original_slug}-{counter}"
             counter += 1
+
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+        old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first() if self.pk else None
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError("A category cannot be moved under itself or one of its subcategories.")
+
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
         super().save(*args, **kwargs)
+
+        new_path = f"{parent_path}{self.pk}/"
+        if new_path != old_path:
+            self._move_subtree(old_path, new_path)
+        
+    def _move_subtree(self, old_path, new_path):
+        new_depth = new_path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+
+        if old_path:
+            old_depth = old_path.count('/') - 1
+            Category.objects.filter(
+                path__gt=old_path, path__lt=self.subtree_upper_bound(old_path)
+            ).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - old_depth),
+            )
+            # Carry the subtree's products from the old ancestors to the new ones.
+            moved = Category.objects.values_list('subtree_product_count', flat=True).get(pk=self.pk)
+            if moved:
+                old_ancestors = [int(part) for part in old_path.split('/') if part][:-1]
+                new_ancestors = [int(part) for part in new_path.split('/') if part][:-1]
+                Category.objects.filter(pk__in=old_ancestors).update(subtree_product_count=F('subtree_product_count') - moved)
+                Category.objects.filter(pk__in=new_ancestors).update(subtree_product_count=F('subtree_product_count') + moved)
+
+        self.path, self.depth = new_path, new_depth
+
+    @classmethod
+    def adjust_product_count(cls, category_id, delta):
+        """
+        Add `delta` active products to a category and to all its ancestors.
+        """
+        path = cls.objects.filter(pk=category_id).values_list('path', flat=True).first()
+        if not path:
+            return
+        cls.objects.filter(pk=category_id).update(product_count=F('product_count') + delta)
+        cls.objects.filter(pk__in=[int(part) for part in path.split('/') if part]).update(
+            subtree_product_count=F('subtree_product_count') + delta
+        )
+
+    @classmethod
+    def rebuild_tree(cls):
+        """
+        Recompute every path, depth and product count from `parent` and the
+        product table. Returns the number of categories.
+        """
+        categories = {category.pk: category for category in cls.objects.all()}
+        direct = dict(
+            Product.objects.filter(is_active=True).order_by()
+            .values('category_id').annotate(total=Count('id')).values_list('category_id', 'total')
+        )
+
+        def resolve(category, seen=()):
+            if category.pk in seen:
+                raise ValueError(f"Category {category.pk} is its own ancestor.")
+            parent = categories.get(category.parent_id)
+            prefix = resolve(parent, seen + (category.pk,)) if parent else ''
+            return f"{prefix}{category.pk}/"
+
+        for category in categories.values():
+            category.path = resolve(category)
+            category.depth = category.path.count('/') - 1
+            category.product_count = direct.get(category.pk, 0)
+            category.subtree_product_count = 0
+        for category in categories.values():
+            for ancestor_id in category.ancestor_ids:
+                categories[ancestor_id].subtree_product_count += category.product_count
+
+        cls.objects.bulk_update(
+            categories.values(), ['path', 'depth', 'product_count', 'subtree_product_count'], batch_size=500
+        )
+        return len(categories)
         
     def __str__(self):
         return self.name
@@ -86,6 +207,71 @@ class Specification(models.Model):
     
     
 
+class ProductQuerySet(models.QuerySet):
+    def with_rating_summary(self):
+        return self.annotate(
+            average_rating=Coalesce(F('rating_summary__average'), 0.0, output_field=FloatField()),
+            review_count=Coalesce(F('rating_summary__review_count'), 0, output_field=IntegerField()),
+        )
+
+    def in_category(self, category, descendants=False):
+        if descendants:
+            return self.filter(Category.subtree_filter(category.path, prefix='category__'))
+        return self.filter(category=category)
+
+    def decrement_stock(self, quantities):
+        """
+        Take `quantities` ({product_id: quantity}) out of stock in a single
+        conditional UPDATE, so concurrent orders can never oversell. Returns
+        False, changing nothing, when any of the products is missing or short.
+        Bypasses save() and its signals; callers expire cached payloads.
+        """
+        if not quantities:
+            return True
+        enough = Q()
+        for product_id, quantity in quantities.items():
+            enough |= Q(pk=product_id, stock__gte=quantity)
+        new_stock = Case(
+            *[When(pk=product_id, then=F('stock') - quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+            output_field=self.model._meta.get_field('stock'),
+        )
+        with transaction.atomic():
+            updated = self.filter(enough).update(stock=new_stock)
+            if updated != len(quantities):
+                transaction.set_rollback(True)
+                return False
+        return True
+
+    def increment_stock(self, quantities):
+        """
+        Put `quantities` ({product_id: quantity}) back in stock in a single
+        UPDATE relative to the current value. Bypasses save() and its signals;
+        callers expire cached payloads.
+        """
+        if not quantities:
+            return
+        new_stock = Case(
+            *[When(pk=product_id, then=F('stock') + quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+            output_field=self.model._meta.get_field('stock'),
+        )
+        self.filter(pk__in=quantities).update(stock=new_stock)
+
+    def with_feature_image(self, thumbnail_width=400):
+        images = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_feature', 'id')
+        # WebP variant of that same image closest to `thumbnail_width`, preferring larger ones.
+        feature_id = ProductImage.objects.filter(product=OuterRef(OuterRef('pk'))).order_by('-is_feature', 'id').values('id')[:1]
+        thumbnails = ProductImageVariant.objects.filter(image_id=Subquery(feature_id), format='webp').order_by(
+            Case(When(width__gte=thumbnail_width, then=Value(0)), default=Value(1)),
+            Abs(F('width') - thumbnail_width),
+        )
+        return self.annotate(
+            feature_image=Subquery(images.values('image')[:1]),
+            feature_thumbnail=Subquery(thumbnails.values('file')[:1]),
+        )
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     gender = models.ForeignKey(Gender, on_delete=models.CASCADE, related_name='products')
@@ -102,6 +288,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -124,8 +312,29 @@ class ProductImage(models.Model):
     is_feature = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Filled by the image pipeline once variants exist; empty means pending.
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, editable=False)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"{self.product.name} - {self.alt_text}"
+
+
+class ProductImageVariant(models.Model):
+    FORMAT_CHOICES = [('webp', 'WebP'), ('jpeg', 'JPEG')]
+
+    image = models.ForeignKey(ProductImage, on_delete=models.CASCADE, related_name='variants')
+    file = models.ImageField(upload_to='products/variants/')
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['format', 'width']
+
+    def __str__(self):
+        return f"{self.image} - {self.width}px {self.format}"
     
 class Review(models.Model):
     RATING_CHOICES = [(i, str(i)) for i in range(1, 6)]  # 1-5 star
@@ -142,10 +351,154 @@ class Review(models.Model):
     class Meta:
         unique_together = ('product', 'user') 
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['product', 'is_approved', '-created_at', '-id'], name='review_product_recent_idx'),
+            models.Index(fields=['product', 'is_approved', 'rating', 'created_at'], name='review_product_rating_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email}'s review on {self.product.name}: {self.rating}★"
 
+    def rating_snapshot(self):
+        """
+        (product_id, rating) this review contributes to its product's rating
+        summary; the rating is None while the review is not approved.
+        """
+        return self.product_id, self.rating if self.is_approved else None
+
+    @classmethod
+    def locked_snapshot(cls, pk):
+        """
+        `rating_snapshot()` of the stored review, read with a row lock so a
+        concurrent edit can't change it before the summary is updated. Call
+        inside the transaction that performs the write; None if it is gone.
+        """
+        review = cls.objects.select_for_update().filter(pk=pk).only('product_id', 'rating', 'is_approved').first()
+        return review.rating_snapshot() if review is not None else None
+
+
+class ProductRatingSummary(models.Model):
+    """
+    Running totals of a product's approved reviews, updated alongside every
+    review write so catalog reads never aggregate the reviews table.
+    """
+    product = models.OneToOneField('Product', on_delete=models.CASCADE, related_name='rating_summary')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0, db_index=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    HISTOGRAM_FIELDS = ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+    class Meta:
+        verbose_name_plural = 'Product rating summaries'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average:.2f}★ ({self.review_count})"
+
+    @property
+    def histogram(self):
+        return {stars: getattr(self, f'rating_{stars}') for stars in range(1, 6)}
+
+    @classmethod
+    def record(cls, before=None, after=None):
+        """
+        Apply one review write to the summaries. `before` and `after` are the
+        review's `rating_snapshot()` around the write, None when it did not
+        exist. Call inside the transaction that performs the write.
+        """
+        before_product, before_rating = before or (None, None)
+        after_product, after_rating = after or (None, None)
+
+        if before_product == after_product:
+            cls._apply(before_product, before_rating, after_rating)
+        else:
+            cls._apply(before_product, before_rating, None)
+            cls._apply(after_product, None, after_rating)
+
+    @classmethod
+    def _apply(cls, product_id, old_rating, new_rating):
+        if product_id is None or old_rating == new_rating:
+            return
+
+        cls.objects.get_or_create(product_id=product_id)
+        count_delta = int(new_rating is not None) - int(old_rating is not None)
+        sum_delta = (new_rating or 0) - (old_rating or 0)
+        changes = {
+            'review_count': F('review_count') + count_delta,
+            'rating_sum': F('rating_sum') + sum_delta,
+        }
+        if old_rating is not None:
+            changes[f'rating_{old_rating}'] = F(f'rating_{old_rating}') - 1
+        if new_rating is not None:
+            changes[f'rating_{new_rating}'] = F(f'rating_{new_rating}') + 1
+
+        summary = cls.objects.filter(product_id=product_id)
+        summary.update(**changes)
+        # Second statement so the average is computed from the updated totals.
+        summary.filter(review_count=0).update(average=0)
+        summary.filter(review_count__gt=0).update(
+            average=models.ExpressionWrapper(
+                F('rating_sum') * 1.0 / F('review_count'), output_field=FloatField()
+            )
+        )
+
+    @classmethod
+    def rebuild(cls, product_ids=None, batch_size=1000):
+        """
+        Recompute summaries from the reviews table in batches of products.
+        Returns the number of summaries written.
+        """
+        products = Product.objects.order_by('pk').values_list('pk', flat=True)
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+
+        written = 0
+        batch = []
+        for product_id in products.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) >= batch_size:
+                written += cls._rebuild_batch(batch)
+                batch = []
+        if batch:
+            written += cls._rebuild_batch(batch)
+        return written
+
+    @classmethod
+    def _rebuild_batch(cls, product_ids):
+        histogram = {
+            f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)
+        }
+        totals = {
+            row['product_id']: row
+            for row in Review.objects.filter(is_approved=True, product_id__in=product_ids)
+            .order_by()
+            .values('product_id')
+            .annotate(review_count=Count('id'), rating_sum=Sum('rating'), **histogram)
+        }
+
+        summaries = []
+        for product_id in product_ids:
+            row = totals.get(product_id, {})
+            summary = cls(product_id=product_id, review_count=row.get('review_count', 0), rating_sum=row.get('rating_sum') or 0)
+            for field in cls.HISTOGRAM_FIELDS:
+                setattr(summary, field, row.get(field, 0))
+            summary.average = summary.rating_sum / summary.review_count if summary.review_count else 0
+            summaries.append(summary)
+
+        cls.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['review_count', 'rating_sum', 'average', 'updated_at'] + cls.HISTOGRAM_FIELDS,
+        )
+        return len(summaries)
+
 class Wishlist(models.Model):
     user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='wishlist')
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
@@ -0,0 +1,103 @@
+import json
+from base64 import b64decode, b64encode
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the product catalog, so deep pages cost the same as the first one.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class ReviewKeysetPagination(BasePagination):
+    """
+    Keyset pagination for a product's reviews over a composite sort key.
+
+    The cursor carries the sort values of the last review on the page, and the
+    next page starts strictly after them, so every page is one range scan on
+    the matching (product, is_approved, ...) index regardless of depth.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    sort_query_param = 'sort'
+    orderings = {
+        'recent': ('-created_at', '-id'),
+        'highest': ('-rating', '-created_at', '-id'),
+        'lowest': ('rating', 'created_at', 'id'),
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.sort = request.query_params.get(self.sort_query_param, 'recent')
+        if self.sort not in self.orderings:
+            raise ValidationError({self.sort_query_param: f"Choose one of: {', '.join(self.orderings)}."})
+        ordering = self.orderings[self.sort]
+        page_size = self.get_page_size(request)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self._after(queryset.model, ordering, self._decode(encoded, len(ordering))))
+
+        rows = list(queryset.order_by(*ordering)[:page_size + 1])
+        page = rows[:page_size]
+        self.next_values = None
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_values = [getattr(last, field.lstrip('-')) for field in ordering]
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def _after(self, model, ordering, values):
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (DjangoValidationError, ValueError, TypeError):
+                raise NotFound("Invalid cursor")
+            if value is None:
+                raise NotFound("Invalid cursor")
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _decode(self, encoded, length):
+        try:
+            values = json.loads(b64decode(encoded.encode()).decode())
+        except (ValueError, TypeError):
+            raise NotFound("Invalid cursor")
+        if not isinstance(values, list) or len(values) != length:
+            raise NotFound("Invalid cursor")
+        return values
+
+    def _encode(self, values):
+        # Full isoformat: a cursor truncated to milliseconds would repeat or skip rows.
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return b64encode(json.dumps(values).encode()).decode()
+
+    def get_paginated_response(self, data):
+        next_url = None
+        if self.next_values is not None:
+            url = self.request.build_absolute_uri()
+            next_url = replace_query_param(url, self.cursor_query_param, self._encode(self.next_values))
+        return Response({'next': next_url, 'sort': self.sort, 'results': data})
@@ -0,0 +1,62 @@
+"""
+Cache of the shared part of product detail responses.
+
+Entries are keyed by slug plus two version numbers: one per slug, bumped when
+the product or anything nested in its payload changes, and one for the whole
+catalog, bumped when shared lookups (brands, categories, sizes...) change.
+Bumping a version orphans the old entries, which then expire on their own.
+Versions are unique timestamps kept as long as the entries, so a version
+that expires can only fall back to 0 once every entry made under it is gone.
+Per-user fields such as `is_in_wishlist` are never cached.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'products:detail:catalog-version'
+
+# Bumped whenever the shape of the cached payload changes.
+PAYLOAD_VERSION = 2
+
+PER_USER_FIELDS = ('is_in_wishlist',)
+
+
+def _slug_version_key(slug):
+    return f'products:detail:version:{slug}'
+
+
+def _versions(slug):
+    values = cache.get_many([CATALOG_VERSION_KEY, _slug_version_key(slug)])
+    return values.get(CATALOG_VERSION_KEY, 0), values.get(_slug_version_key(slug), 0)
+
+
+def _entry_key(slug, versions):
+    return f'products:detail:v{PAYLOAD_VERSION}:{versions[0]}:{versions[1]}:{slug}'
+
+
+def get_product_detail(slug):
+    return cache.get(_entry_key(slug, _versions(slug)))
+
+
+def set_product_detail(slug, data):
+    shared = {key: value for key, value in data.items() if key not in PER_USER_FIELDS}
+    cache.set(_entry_key(slug, _versions(slug)), shared, _timeout())
+
+
+def _timeout():
+    return getattr(settings, 'PRODUCT_DETAIL_CACHE_TIMEOUT', 60 * 60)
+
+
+def _bump(key):
+    cache.set(key, time.time_ns(), _timeout())
+
+
+def invalidate_product(*slugs):
+    for slug in slugs:
+        if slug:
+            _bump(_slug_version_key(slug))
+
+
+def invalidate_catalog():
+    _bump(CATALOG_VERSION_KEY)
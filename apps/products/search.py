@@ -0,0 +1,111 @@
+"""
+Full-text product search on an SQLite FTS5 table.
+
+`products_product_fts` holds one row per active product (rowid = product id)
+with the product name, description, brand and category names, and its
+specification name/value pairs. Rows are refreshed by the signal handlers in `signals.py`;
+`manage.py rebuild_search_index` reindexes the whole catalog.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = 'products_product_fts'
+
+# bm25() column weights: name, description, brand, category, specifications.
+COLUMN_WEIGHTS = (10.0, 1.0, 5.0, 3.0, 2.0)
+
+BATCH_SIZE = 500
+
+_INDEX_SELECT = f"""
+    INSERT INTO {FTS_TABLE} (rowid, name, description, brand, category, specifications)
+    SELECT p.id, p.name, p.description, b.name, c.name,
+           (SELECT group_concat(s.name || ' ' || s.value, ' ')
+              FROM products_specification s WHERE s.product_id = p.id)
+      FROM products_product p
+      JOIN products_brand b ON b.id = p.brand_id
+      JOIN products_category c ON c.id = p.category_id
+     WHERE p.is_active
+"""
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    """
+    Turn free text into a safe FTS5 MATCH expression: every word must match,
+    and the last word also matches as a prefix (search-as-you-type).
+    """
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_product_ids(query, limit=24, offset=0):
+    """
+    Return ids of active products matching `query`, best match first.
+    """
+    expression = build_match_expression(query)
+    if expression is None:
+        return []
+
+    if not is_available():
+        terms = re.findall(r'\w+', query)
+        condition = Q()
+        for term in terms:
+            condition &= Q(name__icontains=term) | Q(description__icontains=term)
+        return list(
+            Product.objects.filter(condition, is_active=True).order_by('-created_at')
+            .values_list('id', flat=True)[offset:offset + limit]
+        )
+
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            # The is_active filter also hides inactive products indexed before the index
+            # skipped them.
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"AND rowid IN (SELECT id FROM products_product WHERE is_active) "
+            f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s OFFSET %s",
+            [expression, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def index_products(product_ids):
+    """
+    Refresh the index rows of the given products. Ids of deleted or
+    deactivated products simply drop out of the index.
+    """
+    if not is_available():
+        return
+    product_ids = list(product_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            batch = product_ids[start:start + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch)
+            cursor.execute(f"{_INDEX_SELECT} AND p.id IN ({placeholders})", batch)
+
+
+def rebuild_index():
+    """
+    Reindex the whole catalog with a single INSERT ... SELECT and optimize the
+    FTS b-trees afterwards. Returns the number of indexed products.
+    """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(_INDEX_SELECT)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
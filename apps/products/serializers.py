@@ -1,9 +1,25 @@
 from rest_framework import serializers
-from django.db.models import Avg
+from django.core.files.storage import default_storage
+from drf_yasg.utils import swagger_serializer_method
 from .models import *
 
 
 
+def wishlist_product_ids(context):
+    """
+    IDs of the products in the requesting user's wishlist. Loaded once and kept
+    in the serializer context, so every nested product serializer shares it.
+    """
+    if 'wishlist_product_ids' not in context:
+        request = context.get('request', None)
+        if request and request.user.is_authenticated:
+            ids = set(Wishlist.objects.filter(user=request.user).values_list('product_id', flat=True))
+        else:
+            ids = set()
+        context['wishlist_product_ids'] = ids
+    return context['wishlist_product_ids']
+
+
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
         model = Brand
@@ -34,10 +50,30 @@ class SpecificationSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'value']
 
 
+class ProductImageVariantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImageVariant
+        fields = ['file', 'format', 'width', 'height']
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = ProductImageVariantSerializer(many=True, read_only=True)
+    srcset = serializers.SerializerMethodField()
+
+    def get_srcset(self, obj):
+        """
+        `srcset` attribute values per format, e.g. {"webp": "<url> 200w, <url> 400w"}.
+        """
+        request = self.context.get('request', None)
+        srcset = {}
+        for variant in obj.variants.all():
+            url = request.build_absolute_uri(variant.file.url) if request else variant.file.url
+            srcset.setdefault(variant.format, []).append(f"{url} {variant.width}w")
+        return {image_format: ', '.join(entries) for image_format, entries in srcset.items()}
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'alt_text', 'is_feature']
+        fields = ['id', 'image', 'alt_text', 'is_feature', 'width', 'height', 'variants', 'srcset']
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -55,9 +91,12 @@ class ReviewSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         user = self.context['request'].user
-        product = data['product']
+        product = data.get('product', self.instance.product if self.instance else None)
         
-        if Review.objects.filter(user=user, product=product).exists():
+        existing = Review.objects.filter(user=user, product=product)
+        if self.instance:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
             raise serializers.ValidationError("شما قبلاً برای این محصول نظر داده‌اید.")
         return data
     
@@ -80,19 +119,40 @@ class ProductSerializer(serializers.ModelSerializer):
     specifications = SpecificationSerializer(many=True, read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
 
-    reviews = ReviewSerializer(many=True, read_only=True, source='reviews.all') 
     average_rating = serializers.SerializerMethodField()
+    review_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
     is_in_wishlist = serializers.SerializerMethodField()
 
+    def _rating_summary(self, obj):
+        try:
+            return obj.rating_summary
+        except ProductRatingSummary.DoesNotExist:
+            return None
+
     def get_average_rating(self, obj):
-        avg_rating = obj.reviews.filter(is_approved=True).aggregate(Avg('rating'))['rating__avg']
+        # Annotated by `Product.objects.with_rating_summary()`; products loaded
+        # elsewhere read the same numbers from their summary row.
+        if hasattr(obj, 'average_rating'):
+            avg_rating = obj.average_rating
+        else:
+            summary = self._rating_summary(obj)
+            avg_rating = summary.average if summary else None
         return round(avg_rating, 2) if avg_rating else None
 
+    def get_review_count(self, obj):
+        if hasattr(obj, 'review_count'):
+            return obj.review_count
+        summary = self._rating_summary(obj)
+        return summary.review_count if summary else 0
+
+    @swagger_serializer_method(serializer_or_field=serializers.DictField(child=serializers.IntegerField()))
+    def get_rating_histogram(self, obj):
+        summary = self._rating_summary(obj)
+        return summary.histogram if summary else {stars: 0 for stars in range(1, 6)}
+
     def get_is_in_wishlist(self, obj):
-        request = self.context.get('request', None)
-        if request and request.user.is_authenticated:
-            return Wishlist.objects.filter(user=request.user, product=obj).exists()
-        return False
+        return obj.id in wishlist_product_ids(self.context)
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -103,9 +163,6 @@ class ProductSerializer(serializers.ModelSerializer):
         except (ValueError, TypeError):
             pass
         
-        approved_reviews = instance.reviews.filter(is_approved=True)
-        data['reviews'] = ReviewSerializer(approved_reviews, many=True, context=self.context).data
-        
         return data
 
     class Meta:
@@ -114,15 +171,58 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'description', 'price', 'stock', 'is_active', 
             'category', 'category_id', 'brand', 'gender', 'sizes', 'colors', 
             'specifications', 'images', 'created_at', 'updated_at',
-            'reviews', 'average_rating', 'is_in_wishlist' 
+            'average_rating', 'review_count', 'rating_histogram', 'is_in_wishlist' 
         ]
         read_only_fields = [
             'id', 'slug', 'created_at', 'updated_at', 
-            'reviews', 'average_rating', 'is_in_wishlist' 
+            'average_rating', 'review_count', 'rating_histogram', 'is_in_wishlist' 
         ]
         
 
 
+class ProductListSerializer(serializers.ModelSerializer):
+    """
+    Lean product card for catalog listings. Expects a queryset built with
+    `with_rating_summary()` and `with_feature_image()`.
+    """
+    feature_image = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
+    average_rating = serializers.SerializerMethodField()
+    review_count = serializers.IntegerField(read_only=True)
+
+    def _file_url(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        request = self.context.get('request', None)
+        return request.build_absolute_uri(url) if request else url
+
+    def get_feature_image(self, obj):
+        return self._file_url(obj.feature_image)
+
+    def get_thumbnail(self, obj):
+        return self._file_url(getattr(obj, 'feature_thumbnail', None) or obj.feature_image)
+
+    def get_average_rating(self, obj):
+        return round(obj.average_rating, 2) if obj.average_rating else None
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        
+        try:
+            data['price'] = int(float(data['price']))
+            data['price_with_commas'] = "{:,.0f}".format(data['price'])
+        except (ValueError, TypeError):
+            pass
+        
+        return data
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'slug', 'price', 'feature_image', 'thumbnail', 'average_rating', 'review_count']
+        read_only_fields = fields
+
+
 class WishlistCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Wishlist
@@ -140,6 +240,19 @@ class WishlistCreateSerializer(serializers.ModelSerializer):
 class WishlistSerializer(serializers.ModelSerializer):
     product_details = ProductSerializer(source='product', read_only=True)
     
+    class Meta:
+        model = Wishlist
+        fields = ['id', 'product', 'product_details', 'added_at']
+        read_only_fields = ['added_at']
+
+
+class WishlistCompactSerializer(serializers.ModelSerializer):
+    """
+    Wishlist item with a lean product card instead of the full product. Expects
+    the product to be loaded with `with_rating_summary()` and `with_feature_image()`.
+    """
+    product_details = ProductListSerializer(source='product', read_only=True)
+
     class Meta:
         model = Wishlist
         fields = ['id', 'product', 'product_details', 'added_at']
@@ -0,0 +1,216 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import image_pipeline, product_cache, search
+from .category_tree import invalidate_category_tree
+from .conditional import bump_version
+from .facets import facet_index
+from .models import Brand, Category, Color, Gender, Product, ProductImage, Review, Size, Specification, Wishlist
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not raw:
+        instance._previous_state = (
+            Product.objects.filter(pk=instance.pk).values('category_id', 'is_active', 'slug').first()
+        )
+
+
+def expire_category_tree():
+    invalidate_category_tree()
+    bump_version('categories')
+
+
+@receiver(post_save, sender=Product)
+def update_category_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    old_category_id = previous['category_id'] if previous and previous['is_active'] else None
+    new_category_id = instance.category_id if instance.is_active else None
+    if old_category_id != new_category_id:
+        if old_category_id:
+            Category.adjust_product_count(old_category_id, -1)
+        if new_category_id:
+            Category.adjust_product_count(new_category_id, 1)
+        transaction.on_commit(expire_category_tree)
+
+
+@receiver(post_delete, sender=Product)
+def release_category_count(sender, instance, **kwargs):
+    if instance.is_active:
+        Category.adjust_product_count(instance.category_id, -1)
+        transaction.on_commit(expire_category_tree)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_category_tree(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+
+def patch_facets(product_ids):
+    for product_id in product_ids:
+        facet_index.patch(product_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_products([instance.pk])
+    # After commit, so a rolled-back save leaves no bits behind.
+    product_ids = [instance.pk]
+    transaction.on_commit(lambda: patch_facets(product_ids))
+
+
+@receiver(m2m_changed, sender=Product.size.through)
+@receiver(m2m_changed, sender=Product.color.through)
+def reindex_product_variants(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif pk_set:
+        product_ids = list(pk_set)
+    else:
+        transaction.on_commit(facet_index.invalidate)
+        return
+    transaction.on_commit(lambda: patch_facets(product_ids))
+
+
+@receiver(post_save, sender=Specification)
+@receiver(post_delete, sender=Specification)
+def reindex_specification_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_products([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_renamed_products(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    search.index_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Gender)
+@receiver(post_save, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Size)
+@receiver(post_delete, sender=Color)
+def invalidate_facets(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    transaction.on_commit(facet_index.invalidate)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def expire_product_detail(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_state', None)
+    slugs = (instance.slug, previous['slug'] if previous else None)
+    # After commit, so a concurrent reader can't re-cache the old state.
+    transaction.on_commit(lambda: product_cache.invalidate_product(*slugs))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Specification)
+@receiver(post_delete, sender=Specification)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def expire_parent_product_detail(sender, instance, **kwargs):
+    slug = Product.objects.filter(pk=instance.product_id).values_list('slug', flat=True).first()
+    transaction.on_commit(lambda: product_cache.invalidate_product(slug))
+
+
+@receiver(m2m_changed, sender=Product.size.through)
+@receiver(m2m_changed, sender=Product.color.through)
+def expire_variant_product_detail(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        slug = instance.slug
+        transaction.on_commit(lambda: product_cache.invalidate_product(slug))
+    else:
+        transaction.on_commit(product_cache.invalidate_catalog)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Gender)
+@receiver(post_save, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Size)
+@receiver(post_delete, sender=Color)
+def expire_catalog_details(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    transaction.on_commit(product_cache.invalidate_catalog)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Specification)
+@receiver(post_delete, sender=Specification)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Gender)
+@receiver(post_delete, sender=Gender)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def bump_product_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('products'))
+
+
+@receiver(m2m_changed, sender=Product.size.through)
+@receiver(m2m_changed, sender=Product.color.through)
+def bump_product_variant_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_version('products'))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('products', 'categories'))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def bump_brand_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('products', 'brands'))
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def bump_wishlist_version(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_version(f'wishlist:{user_id}'))
+
+
+@receiver(pre_save, sender=ProductImage)
+def reset_replaced_image(sender, instance, raw=False, **kwargs):
+    if raw or not instance.pk:
+        return
+    stored_name = ProductImage.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if stored_name != instance.image.name:
+        instance.content_hash = ''
+
+
+@receiver(post_save, sender=ProductImage)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or instance.content_hash or not instance.image:
+        return
+    image_pipeline.schedule_variants(instance.pk)
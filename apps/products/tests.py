@@ -0,0 +1,53 @@
+import json
+from base64 import b64encode
+from decimal import Decimal
+
+from rest_framework.test import APITestCase
+
+from apps.accounts.models import User
+
+from .models import Brand, Category, Gender, Product, Review
+
+
+def encode_cursor(values):
+    return b64encode(json.dumps(values).encode()).decode()
+
+
+class ReviewCursorTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            category=Category.objects.create(name='Shoes'),
+            brand=Brand.objects.create(name='Acme'),
+            gender=Gender.objects.create(name='Men'),
+            name='Runner', description='A running shoe', price=Decimal('100.00'), stock=5,
+        )
+        for index in range(3):
+            user = User.objects.create_user(f'reviewer{index}', f'reviewer{index}@example.com', 'pw')
+            Review.objects.create(
+                product=cls.product, user=user, rating=index + 1, title='t', comment='c', is_approved=True
+            )
+        cls.url = f'/api/products/products/{cls.product.slug}/reviews/'
+
+    def test_paginates_with_issued_cursor(self):
+        first = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(first.status_code, 200)
+        second = self.client.get(first.json()['next'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(first.json()['results']) + len(second.json()['results']), 3)
+
+    def test_cursor_with_wrongly_typed_values_is_not_found(self):
+        cursors = [
+            encode_cursor(['x', 'x']),
+            encode_cursor([None, None]),
+            encode_cursor([[1], {'a': 1}]),
+            encode_cursor(['x', 'x', 'x']),
+        ]
+        for sort, cursor in zip(['recent', 'recent', 'recent', 'highest'], cursors):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'sort': sort, 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_undecodable_cursor_is_not_found(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
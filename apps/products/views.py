@@ -1,8 +1,17 @@
 from rest_framework import viewsets, permissions, status, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Prefetch
 from .models import *
 from .serializers import *
+from .pagination import ProductCursorPagination, ReviewKeysetPagination
+from .filters import ProductCategoryFilter, ProductOrderingFilter
+from .category_tree import get_category_tree
+from . import product_cache, search
+from .conditional import conditional_get
+from .facets import FACETS, facet_index, parse_price
+from decimal import InvalidOperation
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
@@ -20,25 +29,47 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all().prefetch_related(
-        'reviews', 
+    queryset = Product.objects.with_rating_summary().prefetch_related(
         'size',   
         'color',   
-        'images',
+        'images__variants',
         'specifications'
-    ).select_related('category', 'brand', 'gender') 
+    ).select_related('category', 'brand', 'gender', 'rating_summary') 
     serializer_class = ProductSerializer
     http_method_names = ['get']
     lookup_field = 'slug'
     permission_classes = [permissions.AllowAny]
-    pagination_class = None 
-    page_size = 1000  
+    pagination_class = ProductCursorPagination
+    filter_backends = [ProductOrderingFilter, ProductCategoryFilter]
+    ordering_fields = ['created_at', 'price', 'average_rating', 'review_count']
+    ordering = ('-created_at', '-id')
+    conditional_tables = ('products',)
+    conditional_per_user = True
+    
+    def get_queryset(self):
+        if self.action in ('list', 'search_products', 'facets'):
+            # Listings show active products only, like search and facet counts.
+            return Product.objects.filter(is_active=True).with_rating_summary().with_feature_image()
+        return super().get_queryset()
+    
+    def get_serializer_class(self):
+        if self.action in ('list', 'search_products', 'facets'):
+            return ProductListSerializer
+        return ProductSerializer
     
     @swagger_auto_schema(
         tags=["Products"],
         operation_summary="List all products",
-        operation_description="Returns a list of all available products in the store"
+        operation_description="Returns a cursor-paginated list of lean product cards. Follow the `next` link to fetch the following page; use the detail endpoint for the full product.",
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor taken from the previous page", type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description="Number of products per page (max 100)", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('ordering', openapi.IN_QUERY, description="Sort by created_at, price, average_rating or review_count; prefix with '-' for descending", type=openapi.TYPE_STRING),
+            openapi.Parameter('category', openapi.IN_QUERY, description="Category slug", type=openapi.TYPE_STRING),
+            openapi.Parameter('descendants', openapi.IN_QUERY, description="Set to 1 to include products of all subcategories", type=openapi.TYPE_INTEGER),
+        ]
     )
+    @conditional_get
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
@@ -48,8 +79,137 @@ class ProductViewSet(viewsets.ModelViewSet):
         operation_summary="Retrieve product details",
         operation_description="Get detailed information about a specific product"
     )
+    @conditional_get
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        slug = kwargs[self.lookup_field]
+        context = self.get_serializer_context()
+        
+        data = product_cache.get_product_detail(slug)
+        if data is None:
+            data = ProductSerializer(self.get_object(), context=context).data
+            product_cache.set_product_detail(slug, data)
+        
+        data = dict(data)
+        data['is_in_wishlist'] = data['id'] in wishlist_product_ids(context)
+        return Response(data)
+    
+    @swagger_auto_schema(
+        tags=["Reviews"],
+        operation_summary="List product reviews",
+        operation_description="Approved reviews of a product, newest first by default. Follow the `next` link to fetch the following page.",
+        manual_parameters=[
+            openapi.Parameter('sort', openapi.IN_QUERY, description="recent, highest or lowest", type=openapi.TYPE_STRING),
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor taken from the previous page", type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description="Number of reviews per page (max 100)", type=openapi.TYPE_INTEGER),
+        ]
+    )
+    @action(detail=True, methods=['get'], url_path='reviews')
+    @conditional_get
+    def reviews(self, request, slug=None):
+        product = Product.objects.filter(slug=slug).values_list('id', flat=True).first()
+        if product is None:
+            return Response(
+                {"status": "error", "message": "محصول یافت نشد"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        reviews = Review.objects.filter(product_id=product, is_approved=True).select_related('user')
+        paginator = ReviewKeysetPagination()
+        page = paginator.paginate_queryset(reviews, request, view=self)
+        serializer = ReviewSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+    
+    @swagger_auto_schema(
+        tags=["Products"],
+        operation_summary="Search products",
+        operation_description="Full-text search over product name, description, brand, category and specifications. Results are ranked by relevance; the last word also matches as a prefix.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Search text", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Number of results (max 100)", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('offset', openapi.IN_QUERY, description="Number of results to skip", type=openapi.TYPE_INTEGER),
+        ]
+    )
+    @action(detail=False, methods=['get'], url_path='search')
+    @conditional_get
+    def search_products(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"status": "error", "message": "عبارت جستجو (q) الزامی است"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            limit = min(max(int(request.query_params.get('limit', 24)), 1), 100)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "مقدار limit یا offset نامعتبر است"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        product_ids = search.search_product_ids(query, limit=limit, offset=offset)
+        products = self.get_queryset().in_bulk(product_ids)
+        ranked = [products[product_id] for product_id in product_ids if product_id in products]
+        
+        serializer = self.get_serializer(ranked, many=True)
+        return Response({
+            "query": query,
+            "results": serializer.data,
+            "next_offset": offset + limit if len(product_ids) == limit else None,
+        })
+    
+    @swagger_auto_schema(
+        tags=["Products"],
+        operation_summary="Filter products by facets",
+        operation_description="Filter active products by category, brand, gender, size, color (slugs, comma separated; any of the values within a facet) and price range. Returns the matching count, a page of product cards and, for each facet, how many products every value would match.",
+        manual_parameters=[
+            openapi.Parameter(facet, openapi.IN_QUERY, description=f"Comma separated {facet} slugs", type=openapi.TYPE_STRING)
+            for facet in FACETS
+        ] + [
+            openapi.Parameter('min_price', openapi.IN_QUERY, description="Minimum price", type=openapi.TYPE_NUMBER),
+            openapi.Parameter('max_price', openapi.IN_QUERY, description="Maximum price", type=openapi.TYPE_NUMBER),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Number of products (max 100)", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('offset', openapi.IN_QUERY, description="Number of products to skip", type=openapi.TYPE_INTEGER),
+        ]
+    )
+    @action(detail=False, methods=['get'], url_path='facets')
+    @conditional_get
+    def facets(self, request):
+        selections = {}
+        for facet in FACETS:
+            slugs = [
+                slug.strip()
+                for value in request.query_params.getlist(facet)
+                for slug in value.split(',') if slug.strip()
+            ]
+            if slugs:
+                selections[facet] = slugs
+        
+        try:
+            min_price = parse_price(request.query_params.get('min_price'))
+            max_price = parse_price(request.query_params.get('max_price'))
+            limit = min(max(int(request.query_params.get('limit', 24)), 1), 100)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except (ValueError, InvalidOperation):
+            return Response(
+                {"status": "error", "message": "پارامترهای قیمت یا صفحه‌بندی نامعتبر است"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        count, product_ids, facet_counts, price_range = facet_index.query(
+            selections, min_price=min_price, max_price=max_price, limit=limit, offset=offset
+        )
+        products = self.get_queryset().in_bulk(product_ids)
+        serializer = self.get_serializer([products[pk] for pk in product_ids if pk in products], many=True)
+        
+        return Response({
+            "count": count,
+            "results": serializer.data,
+            "next_offset": offset + limit if offset + limit < count else None,
+            "facets": facet_counts,
+            "price_range": price_range,
+        })
     
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -59,12 +219,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
     lookup_field = 'slug'
     permission_classes = [permissions.AllowAny]
     pagination_class = None
+    conditional_tables = ('categories',)
     
     @swagger_auto_schema(
         tags=['Categories'],
         operation_summary="List all categories",
         operation_description="Returns a list of all product categories"
     )
+    @conditional_get
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
@@ -73,9 +235,20 @@ class CategoryViewSet(viewsets.ModelViewSet):
         operation_summary="Retrieve category details",
         operation_description="Get detailed information about a specific category"
     )
+    @conditional_get
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        tags=['Categories'],
+        operation_summary="Category tree",
+        operation_description="Returns the full category tree with nested children and precomputed product counts (direct and including subcategories)"
+    )
+    @action(detail=False, methods=['get'], url_path='tree')
+    @conditional_get
+    def tree(self, request):
+        return Response(get_category_tree())
+
     
 
 
@@ -86,12 +259,14 @@ class BrandViewSet(viewsets.ModelViewSet):
     http_method_names = ['get']
     permission_classes = [permissions.AllowAny]
     pagination_class = None
+    conditional_tables = ('brands',)
     
     @swagger_auto_schema(
         tags=['Brands'],
         operation_summary="List all brands",
         operation_description="Returns a list of all product brands"
     )
+    @conditional_get
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
@@ -100,6 +275,7 @@ class BrandViewSet(viewsets.ModelViewSet):
         operation_summary="Retrieve brand details",
         operation_description="Get detailed information about a specific brand"
     )
+    @conditional_get
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
     
@@ -183,10 +359,21 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user, is_approved=True)
+        with transaction.atomic():
+            review = serializer.save(user=self.request.user, is_approved=True)
+            ProductRatingSummary.record(after=review.rating_snapshot())
 
     def perform_update(self, serializer):
-        serializer.save(is_approved=True)
+        with transaction.atomic():
+            before = Review.locked_snapshot(serializer.instance.pk)
+            review = serializer.save(is_approved=True)
+            ProductRatingSummary.record(before=before, after=review.rating_snapshot())
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            before = Review.locked_snapshot(instance.pk)
+            instance.delete()
+            ProductRatingSummary.record(before=before)
         
         
         
@@ -203,20 +390,64 @@ class WishlistViewSet(
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ['get', 'post', 'delete']
     pagination_class = None
+    conditional_tables = ('products',)
+    conditional_per_user = True
+    
+    def is_compact(self):
+        return self.request.query_params.get('compact') in ('1', 'true')
     
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Wishlist.objects.none()
-        return Wishlist.objects.filter(user=self.request.user).select_related('product')
+        if self.action == 'list' and self.is_compact():
+            products = Product.objects.with_rating_summary().with_feature_image()
+        else:
+            products = Product.objects.with_rating_summary().select_related(
+                'category', 'brand', 'gender', 'rating_summary'
+            ).prefetch_related('size', 'color', 'images__variants', 'specifications')
+        return Wishlist.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('product', queryset=products)
+        )
     
     @swagger_auto_schema(
         tags=["Wishlist"],
         operation_summary="List wishlist items",
-        operation_description="Returns a list of products in the user's wishlist. Authentication required."
+        operation_description="Returns a list of products in the user's wishlist. Authentication required. Pass compact=1 to get lean product cards instead of full products.",
+        manual_parameters=[
+            openapi.Parameter('compact', openapi.IN_QUERY, description="Set to 1 for lean product cards", type=openapi.TYPE_INTEGER),
+        ]
     )
+    @conditional_get
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
+    @swagger_auto_schema(
+        tags=["Wishlist"],
+        operation_summary="Check products against wishlist",
+        operation_description="Given a comma separated list of product IDs, returns the ones in the user's wishlist. Meant for marking product grids in one request.",
+        manual_parameters=[
+            openapi.Parameter('product_ids', openapi.IN_QUERY, description="Comma separated product IDs (max 200)", type=openapi.TYPE_STRING, required=True),
+        ]
+    )
+    @action(detail=False, methods=['get'], url_path='contains')
+    @conditional_get
+    def contains(self, request):
+        try:
+            product_ids = {int(value) for value in request.query_params.get('product_ids', '').split(',') if value.strip()}
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "شناسه محصولات نامعتبر است"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not product_ids or len(product_ids) > 200:
+            return Response(
+                {"status": "error", "message": "بین ۱ تا ۲۰۰ شناسه محصول لازم است"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        in_wishlist = Wishlist.objects.filter(user=request.user, product_id__in=product_ids).values_list('product_id', flat=True)
+        return Response({"product_ids": sorted(in_wishlist)})
+    
     
     @swagger_auto_schema(
         tags=["Wishlist"],
@@ -267,7 +498,7 @@ class WishlistViewSet(
                 "status": "success", 
                 "message": "محصول به لیست علاقه‌مندی‌ها اضافه شد",
                 "action": "added",
-                "wishlist_item": WishlistSerializer(wishlist_item).data
+                "wishlist_item": WishlistSerializer(wishlist_item, context=self.get_serializer_context()).data
             })
         else:
             wishlist_item.delete()
@@ -280,6 +511,8 @@ class WishlistViewSet(
     def get_serializer_class(self):
         if self.action == 'create':
             return WishlistCreateSerializer
+        if self.action == 'list' and self.is_compact():
+            return WishlistCompactSerializer
         return WishlistSerializer
     
     def perform_create(self, serializer):